@@ -16,22 +16,109 @@ else:
     from program.library.helpers import get
 
 from program.other.crunchbase import Crunchbase
+from program.other.benchmark import DatabaseBenchmark
 
 class Main:
     def run(self):
         self.log.info('Starting')
 
+        if '--export' in sys.argv:
+            self.export()
+            self.cleanUp()
+            return
+
+        if '--migrateJson' in sys.argv:
+            self.migrateJson()
+            self.cleanUp()
+            return
+
+        if '--benchmarkDatabase' in sys.argv:
+            DatabaseBenchmark(self.options).run()
+            self.cleanUp()
+            return
+
+        if '--asOf' in sys.argv:
+            self.showAsOf()
+            self.cleanUp()
+            return
+
+        if '--find' in sys.argv or '--rebuildSearchIndex' in sys.argv:
+            self.find()
+            self.cleanUp()
+            return
+
         inputRows = helpers.getCsvFile(self.options['inputFile'])
 
+        crunchbase = None
+
         try:
             crunchbase = Crunchbase(self.options, self.credentials)
 
             crunchbase.runRepeatedly(inputRows)
         except Exception as e:
             helpers.handleException(e)
+        finally:
+            if crunchbase:
+                crunchbase.close()
         
         self.cleanUp()
 
+    def export(self):
+        crunchbase = None
+
+        try:
+            crunchbase = Crunchbase(self.options, self.credentials)
+
+            crunchbase.export()
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            if crunchbase:
+                crunchbase.close()
+
+    def showAsOf(self):
+        crunchbase = None
+
+        try:
+            crunchbase = Crunchbase(self.options, self.credentials)
+
+            crunchbase.showAsOf(helpers.getParameter('--company', True), helpers.getParameter('--asOf', True))
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            if crunchbase:
+                crunchbase.close()
+
+    def find(self):
+        crunchbase = None
+
+        try:
+            crunchbase = Crunchbase(self.options, self.credentials)
+
+            if '--rebuildSearchIndex' in sys.argv:
+                crunchbase.rebuildSearchIndex()
+
+            if '--find' in sys.argv:
+                crunchbase.find(helpers.getParameter('--find', False))
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            if crunchbase:
+                crunchbase.close()
+
+    def migrateJson(self):
+        crunchbase = None
+
+        try:
+            crunchbase = Crunchbase(self.options, self.credentials)
+
+            crunchbase.migrateJson()
+        except Exception as e:
+            helpers.handleException(e)
+        finally:
+            if crunchbase:
+                crunchbase.close()
+
     def cleanUp(self):
         self.log.info('Done')
         self.log.info('Exiting')
@@ -60,7 +147,53 @@ class Main:
             'resumeSearch': 1,
             'refreshOnly': 0,
             'dateForNewCompaniesSearch': '01/01/2020',
-            'useGoogle': 1
+            'useGoogle': 1,
+            'compactOutputEvery': 1000,
+            'refreshPageSize': 1000,
+            'refreshBudget': 0,
+            'exportFile': '',
+            'exportFormat': 'csv',
+            'exportColumns': '',
+            'exportSince': '',
+            'exportChangedSince': '',
+            'jsonFormat': 'compact',
+            'jsonCompressionLevel': 6,
+            'jsonDictionarySamples': 1000,
+            'rawJsonRetention': 'inline',
+            'rawJsonVersions': 1,
+            'normalizedTables': 0,
+            'searchIndex': 0,
+            'profileHistory': 0,
+            'databaseType': 'sqlite',
+            'mysqlHost': 'localhost',
+            'mysqlUser': '',
+            'mysqlPassword': '',
+            'mysqlDatabase': 'crunchbase',
+            'mysqlPoolSize': 5,
+            'mysqlBatchSize': 500,
+            'mysqlRetries': 10,
+            'benchmarkRows': 10000,
+            'findLimit': 20,
+            'profileWorkers': 1,
+            'parserWorkers': 1,
+            'pipelineQueueSize': 100,
+            'keepAlive': 1,
+            'connectionPoolSize': 10,
+            'commitEveryRows': 100,
+            'commitEveryMilliseconds': 1000,
+            'databaseWriter': 1,
+            'databaseWriterQueueSize': 1000,
+            'databaseWriterBatchSize': 100,
+            'flushOutputEveryRows': 100,
+            'flushOutputEveryMilliseconds': 5000,
+            'sqliteTuning': 1,
+            'sqliteJournalMode': 'wal',
+            'sqliteSynchronous': 'normal',
+            'sqliteBusyTimeout': 30000,
+            'sqliteRetries': 3,
+            'sqliteCacheSize': -64000,
+            'sqliteMmapSize': 256 * 1000 * 1000,
+            'sqliteTempStore': 'memory'
         }
 
         optionsFileName = helpers.getParameter('--optionsFile', False, 'user-data/options.ini')
@@ -71,6 +204,12 @@ class Main:
         # read the options file
         helpers.setOptions(optionsFileName, self.options)
 
+        helpers.setOptionFromParameter('--exportFile', 'exportFile', self.options)
+        helpers.setOptionFromParameter('--format', 'exportFormat', self.options)
+        helpers.setOptionFromParameter('--columns', 'exportColumns', self.options)
+        helpers.setOptionFromParameter('--since', 'exportSince', self.options)
+        helpers.setOptionFromParameter('--changedSince', 'exportChangedSince', self.options)
+
         self.credentials = {}
 
         helpers.setOptions('user-data/credentials/credentials.ini', self.credentials, '')
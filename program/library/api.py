@@ -4,6 +4,9 @@ import os.path
 import random
 import json
 import urllib.parse
+import threading
+import time
+import http.cookiejar
 import requests
 
 from collections import OrderedDict
@@ -17,6 +20,10 @@ else:
     
     from .helpers import get
 
+# headers read by setHeadersFromHarFile. key is (file name, modified time, urlMustContain).
+headersCache = {}
+headersCacheLock = threading.Lock()
+
 class Api:
     def get(self, url, parameters=None, responseIsJson=True, returnResponseObject=False):
         return self.request('GET', url, parameters, None, responseIsJson, returnResponseObject)
@@ -37,8 +44,13 @@ class Api:
         if cacheResponse:
             return cacheResponse
 
+        if self.throttle:
+            self.throttle.wait(self.urlPrefix + url)
+
         try:
-            response = requests.request(requestType, self.urlPrefix + url, params=parameters, headers=self.headers, data=data, proxies=self.proxies, timeout=self.timeout, verify=self.verify)
+            session = self.sessions.get(self.proxies)
+
+            response = session.request(requestType, self.urlPrefix + url, params=parameters, headers=self.headers, data=data, proxies=self.proxies, timeout=self.timeout, verify=self.verify)
 
             self.handleResponseLog(requestType, url, parameters, data, response)
             
@@ -259,34 +271,12 @@ class Api:
 
         return result
 
-    def setHeadersFromHarFile(self, fileName, urlMustContain):
+    def setHeadersFromHarFile(self, fileName, urlMustContain, randomizeUserAgent=True):
         if not os.path.exists(fileName):
             return
 
         try:
-            from pathlib import Path
-            
-            headersList = []
-            
-            if Path(fileName).suffix == '.har':
-                from haralyzer import HarParser
-            
-                file = helpers.getFile(fileName)
-
-                j = json.loads(file)
-
-                har_page = HarParser(har_data=j)
-
-                # find the right url
-                for page in har_page.pages:
-                    for entry in page.entries:
-                        if urlMustContain in entry['request']['url']:
-                            headersList = entry['request']['headers']
-                            break
-
-            else:
-                headersList = helpers.getJsonFile(fileName)
-                headersList = get(headersList, 'headers')
+            headersList = self.getHeadersListFromFile(fileName, urlMustContain)
 
             headers = []
 
@@ -302,7 +292,7 @@ class Api:
                 # otherwise response will stay compressed and unreadable
                 elif name.lower() == 'accept-encoding' and not self.hasBrotli:
                     value = value.replace(', br', '')
-                elif name.lower() == 'user-agent' and get(self.options, 'randomizeUserAgent'):
+                elif name.lower() == 'user-agent' and randomizeUserAgent and get(self.options, 'randomizeUserAgent'):
                     value = random.choice(self.userAgentList)
 
                 newHeader = (name, value)
@@ -314,6 +304,48 @@ class Api:
         except Exception as e:
             helpers.handleException(e)
 
+    # parsing a har file is slow, so each file is only parsed once unless it changes
+    def getHeadersListFromFile(self, fileName, urlMustContain):
+        key = (fileName, os.path.getmtime(fileName), urlMustContain)
+
+        with headersCacheLock:
+            if key in headersCache:
+                return headersCache[key]
+
+        from pathlib import Path
+        
+        headersList = []
+        
+        if Path(fileName).suffix == '.har':
+            from haralyzer import HarParser
+        
+            file = helpers.getFile(fileName)
+
+            j = json.loads(file)
+
+            har_page = HarParser(har_data=j)
+
+            # find the right url
+            for page in har_page.pages:
+                for entry in page.entries:
+                    if urlMustContain in entry['request']['url']:
+                        headersList = entry['request']['headers']
+                        break
+
+        else:
+            headersList = helpers.getJsonFile(fileName)
+            headersList = get(headersList, 'headers')
+
+        with headersCacheLock:
+            # forget older versions of the file
+            for oldKey in list(headersCache.keys()):
+                if oldKey[0] == fileName and oldKey[2] == urlMustContain:
+                    del headersCache[oldKey]
+
+            headersCache[key] = headersList
+
+        return headersList
+
     def getHeadersFromFile(self, fileName):
         file = helpers.getFile(fileName)
 
@@ -377,9 +409,79 @@ class Api:
         self.verify = True
         self.hasBrotli = True
         self.cachePostRequests = False
+        self.throttle = None
+        # can be shared by several api objects
+        self.sessions = Sessions(options)
 
         try:
             import brotli
         except ImportError as e:
             self.hasBrotli = False
-            helpers.handleException(e, 'You should run "pip3 install brotli" or "pip install brotli" first, then restart this script')
\ No newline at end of file
+            helpers.handleException(e, 'You should run "pip3 install brotli" or "pip install brotli" first, then restart this script')
+
+# spaces out requests to the same host when several threads share it
+class Throttle:
+    def wait(self, url):
+        if not self.secondsBetweenRequests:
+            return
+
+        host = urllib.parse.urlparse(url).netloc
+
+        with self.lock:
+            now = time.monotonic()
+
+            # reserve the next free slot so other threads queue up behind it
+            nextRequest = max(now, self.nextRequests.get(host, now))
+            self.nextRequests[host] = nextRequest + self.secondsBetweenRequests
+
+        if nextRequest > now:
+            time.sleep(nextRequest - now)
+
+    def __init__(self, secondsBetweenRequests):
+        self.secondsBetweenRequests = secondsBetweenRequests
+        self.nextRequests = {}
+        self.lock = threading.Lock()
+
+
+# keeps connections open between requests. one session per proxy.
+class Sessions:
+    def get(self, proxies):
+        # module-level requests opens a new connection every time
+        if not self.keepAlive:
+            return requests
+
+        key = ''
+
+        if proxies:
+            key = proxies.get('https', '') or proxies.get('http', '')
+
+        with self.lock:
+            session = self.sessions.get(key)
+
+            if not session:
+                session = requests.Session()
+
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.poolSize, pool_maxsize=self.poolSize)
+
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                # the headers decide which cookies to send, like they did before sessions
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+                self.sessions[key] = session
+
+        return session
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+
+            self.sessions = {}
+
+    def __init__(self, options=None):
+        self.poolSize = get(options, 'connectionPoolSize') or 10
+        self.keepAlive = get(options, 'keepAlive') != 0
+        self.sessions = {}
+        self.lock = threading.Lock()
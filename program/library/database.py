@@ -4,6 +4,9 @@ import sqlite3
 import logging
 import time
 import random
+import queue
+import threading
+import contextlib
 
 if '--debug' in sys.argv:
     import helpers as helpers
@@ -15,25 +18,29 @@ else:
     from .helpers import get
 
 class Database:
-    def execute(self, statement, returnResult=False):
-        self.executeWithRetries(statement)
-
-        if not returnResult:
-            return
-        
-        try:
-            rows = self.cursor.fetchall()
+    def execute(self, statement, returnResult=False, parameters=None):
+        # the cursor is shared, so a statement and fetching its rows can't be interleaved with another thread's
+        with self.lock:
+            self.executeWithRetries(statement, parameters)
+
+            if not returnResult:
+                self.commit()
+                return
+            
+            try:
+                rows = self.cursor.fetchall()
 
-            result = []
-        
-            for row in rows:
-                result.append(dict(row))
+                result = []
+            
+                for row in rows:
+                    result.append(dict(row))
 
-            return result
-        except Exception as e:
-            self.handleException(e)
+                return result
+            except Exception as e:
+                self.handleException(e)
 
-    def get(self, table, columns, where, orderBy=None, orderType=None, limit=None):
+    # parameters are for placeholders in where. see self.placeholder.
+    def get(self, table, columns, where, orderBy=None, orderType=None, limit=None, parameters=None):
         result = []
 
         wherePart = ''
@@ -51,48 +58,147 @@ class Database:
 
         query = f'select {columns} from {table}{wherePart}{orderByPart}{limitPart};'
 
-        self.executeWithRetries(query)
+        with self.lock:
+            self.executeWithRetries(query, parameters)
 
-        try:
-            rows = self.cursor.fetchall()
+            try:
+                rows = self.cursor.fetchall()
 
-            for row in rows:
-                result.append(dict(row))
-        except Exception as e:
-            self.handleException(e)
+                for row in rows:
+                    result.append(dict(row))
+            except Exception as e:
+                self.handleException(e)
 
         return result
 
-    def getFirst(self, table, columns, where, orderBy=None, orderType=None):
+    # yields rows a batch at a time instead of loading them all into memory
+    def iterate(self, query, parameters=None, batchSize=1000):
+        cursor = None
+        connection = None
+
+        with self.lock:
+            if self.type == 'sqlite':
+                cursor = self.connection.cursor()
+            elif self.type == 'mysql':
+                # its own connection so other queries can run while rows are still coming
+                connection = self.pool.get_connection()
+
+                # unbuffered means the server sends rows as they're fetched
+                cursor = connection.cursor(dictionary=True, buffered=False)
+
+            cursor.execute(query, parameters or [])
+
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(batchSize)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+            if connection:
+                # back to the pool
+                connection.close()
+
+    def getFirst(self, table, columns, where, orderBy=None, orderType=None, parameters=None):
         result = {}
 
-        rows = self.get(table, columns, where, orderBy, orderType, 1)
+        rows = self.get(table, columns, where, orderBy, orderType, 1, parameters)
 
         if len(rows) > 0:
             result = rows[0]
 
         return result
 
-    def executeWithRetries(self, query):
-        maximumTries = 1000
+    # many means parameters is a list of rows
+    def executeWithRetries(self, query, parameters=None, many=False):
+        tries = 0
+        replay = False
+
+        while True:
+            tries += 1
 
-        for i in range(0, maximumTries):
             try:
-                self.cursor.execute(query)
+                if replay:
+                    for pending in self.pendingStatements:
+                        self.executeStatement(*pending)
+
+                    replay = False
+
+                if self.type == 'sqlite' and self.isWrite(query) and not self.connection.in_transaction:
+                    # takes the write lock up front. sqlite waits up to busy_timeout for other processes to finish writing.
+                    self.cursor.execute('begin immediate')
+
+                self.executeStatement(query, parameters, many)
+
+                if self.type == 'mysql' and self.isWrite(query):
+                    self.pendingStatements.append((query, parameters, many))
 
                 # if it's here it means it succeeded
                 break
             except sqlite3.OperationalError as e:
-                if str(e) == 'database is locked':
-                    logging.error(f'Database locked. Retrying. {i + 1} of {maximumTries}.')
+                # busy_timeout already waited, so this is rare
+                if self.isBusy(e) and tries < self.sqliteRetries:
+                    logging.warning(f'Database still locked after waiting {self.busyTimeout} ms. Retrying. {tries} of {self.sqliteRetries}.')
+                elif self.isBusy(e) and self.isWrite(query):
+                    # the caller decides whether to try again later. otherwise the row would be lost.
+                    raise
+                else:
+                    self.handleException(e)
+                    break
+            except Exception as e:
+                errorNumber = getattr(e, 'errno', None)
+
+                # deadlock or lock wait timeout. anything else is a real error.
+                if self.type == 'mysql' and self.isBusy(e) and tries < self.mysqlRetries:
+                    logging.warning(f'{"Deadlock" if errorNumber == 1213 else "Lock wait timeout"}. Retrying. {tries} of {self.mysqlRetries}.')
 
-                    seconds = random.randrange(100, 1000) / 1000
-                    time.sleep(seconds)
+                    # a deadlock rolls back the whole transaction, so everything since the last commit is done again
+                    if errorNumber == 1213:
+                        replay = True
+
+                    time.sleep(min(0.1 * 2 ** tries, 5) * random.uniform(0.5, 1.5))
+                elif self.type == 'mysql' and self.isBusy(e) and self.isWrite(query):
+                    raise
                 else:
                     self.handleException(e)
                     break
 
-        self.connection.commit()
+    # another process or connection had the lock for too long
+    def isBusy(self, e):
+        if isinstance(e, sqlite3.OperationalError):
+            return str(e) == 'database is locked'
+
+        return getattr(e, 'errno', None) in [1213, 1205]
+
+    def isWrite(self, query):
+        words = query.lower().split(None, 5)
+
+        if not words or not words[0] in ['insert', 'update', 'delete', 'replace', 'create', 'drop', 'alter', 'savepoint']:
+            return False
+
+        # temporary tables belong to this connection. other processes don't need to wait while they're made.
+        if words[1:2] in [['temp'], ['temporary']]:
+            return False
+
+        for word in words[1:5]:
+            if word.startswith('temp.'):
+                return False
+
+        return True
+
+    def executeStatement(self, query, parameters=None, many=False):
+        if many:
+            self.cursor.executemany(query, parameters)
+        elif parameters:
+            self.cursor.execute(query, parameters)
+        else:
+            self.cursor.execute(query)
 
     def insert(self, table, toInsert):
         if not toInsert:
@@ -103,52 +209,171 @@ class Database:
         if isinstance(toInsert, list):
             items = toInsert
             toInsert = None
-
-            logging.debug(f'Inserting into {len(items)} into {table}')
         else:
-            logging.debug(f'Inserting into {table}: {toInsert}')
             items.append(toInsert)
 
-        columns = []
+        logging.debug(f'Inserting {len(items)} into {table}')
 
-        for key in items[0]:
-            columns.append(key)
+        columns = list(items[0].keys())
 
-        columns = ', '.join(columns)
+        rows = []
 
-        groupsOfValues = []
+        for item in items:
+            row = []
 
-        for item in items:            
-            values = []
-            
-            for key, value in item.items():
-                # escape single quotes
-                if isinstance(value, str):
-                    value = "'" + value.replace("'", "''") + "'"
-                elif value == None:
-                    value = 'null'
+            for column in columns:
+                row.append(item.get(column))
 
-                values.append(str(value))
+            rows.append(row)
 
-            values = ', '.join(values)
-            values = f'({values})'
+        columnsString = ', '.join(columns)
+        placeholders = ', '.join([self.placeholder] * len(columns))
 
-            groupsOfValues.append(values)
+        with self.lock:
+            self.updateSearchIndex(table, items, True)
 
-        groupsOfValues = ', '.join(groupsOfValues)
+            if self.type == 'sqlite':
+                self.executeWithRetries(f'insert or replace into {table} ({columnsString}) values ({placeholders})', rows, many=True)
+            elif self.type == 'mysql':
+                self.insertMysql(table, columns, rows)
 
-        query = ''
+            self.updateSearchIndex(table, items, False)
 
-        if self.type == 'sqlite':
-            query = f'insert or replace into {table} ({columns}) values {groupsOfValues};'
-        elif self.type == 'mysql':
-            query = f'replace into {table} ({columns}) values {groupsOfValues};'
+            self.uncommittedRows += len(rows)
+
+            self.commitIfNeeded()
+
+    # one statement per batch is much faster than one per row. updates rows that already exist instead of deleting them like replace into.
+    def insertMysql(self, table, columns, rows):
+        columnsString = ', '.join(columns)
+        placeholders = ', '.join([self.placeholder] * len(columns))
 
-        self.executeWithRetries(query)
+        updates = []
+
+        for column in columns:
+            updates.append(f'{column} = values({column})')
+
+        updatePart = ', '.join(updates)
+
+        for i in range(0, len(rows), self.mysqlBatchSize):
+            batch = rows[i:i + self.mysqlBatchSize]
+
+            parameters = []
+
+            for row in batch:
+                parameters += row
+
+            valuesPart = ', '.join([f'({placeholders})'] * len(batch))
+
+            self.executeWithRetries(f'insert into {table} ({columnsString}) values {valuesPart} on duplicate key update {updatePart}', parameters)
+
+    # runs a statement once for each row of parameters. commits like insert.
+    def executeMany(self, statement, rows):
+        if not rows:
+            return
+
+        with self.lock:
+            self.executeWithRetries(statement, rows, many=True)
+
+            self.uncommittedRows += len(rows)
+
+            self.commitIfNeeded()
+
+    # writes inside the block are committed together. other threads wait until it's done.
+    # if the block fails, its writes are undone but the ones before it aren't.
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.transactionDepth += 1
+
+            name = f'transaction{self.transactionDepth}'
+
+            # mysql mustn't replay undone statements after a deadlock
+            pendingCount = len(self.pendingStatements)
+
+            try:
+                self.executeWithRetries(f'savepoint {name}')
+
+                try:
+                    yield
+                except Exception:
+                    self.executeWithRetries(f'rollback to savepoint {name}')
+                    self.executeWithRetries(f'release savepoint {name}')
+
+                    del self.pendingStatements[pendingCount:]
+
+                    raise
+
+                self.executeWithRetries(f'release savepoint {name}')
+            finally:
+                self.transactionDepth -= 1
+
+                self.commitIfNeeded()
+
+    # group commit. see commitEveryRows and commitEveryMilliseconds.
+    def commitIfNeeded(self):
+        if self.transactionDepth:
+            return
+
+        if self.uncommittedRows >= self.commitEveryRows:
+            self.commit()
+        elif self.commitEveryMilliseconds and time.monotonic() - self.lastCommit >= self.commitEveryMilliseconds / 1000:
+            self.commit()
+        elif self.uncommittedRows:
+            self.startCommitTimer()
+
+    # the transaction holds the write lock. if nothing else gets written for a while, like during a captcha wait,
+    # the timer commits so other processes aren't locked out.
+    def startCommitTimer(self):
+        if not self.commitEveryMilliseconds or self.commitTimer:
+            return
+
+        self.commitTimer = threading.Timer(self.commitEveryMilliseconds / 1000, self.onCommitTimer)
+        self.commitTimer.daemon = True
+        self.commitTimer.start()
+
+    def onCommitTimer(self):
+        with self.lock:
+            self.commitTimer = None
+
+            if not self.connection or not self.uncommittedRows:
+                return
+
+            # the transaction commits when it ends
+            if self.transactionDepth:
+                self.startCommitTimer()
+                return
+
+            self.commit()
+
+    def stopCommitTimer(self):
+        if self.commitTimer:
+            self.commitTimer.cancel()
+            self.commitTimer = None
+
+    def commit(self):
+        with self.lock:
+            self.stopCommitTimer()
+
+            try:
+                self.connection.commit()
+            except Exception as e:
+                self.handleException(e)
+
+            self.uncommittedRows = 0
+            self.lastCommit = time.monotonic()
+            self.pendingStatements = []
+
+    # writes anything that's waiting for the next group commit
+    def flush(self):
+        if self.connection and self.uncommittedRows:
+            self.commit()
 
     def makeTables(self, fileName):
         tables = helpers.getJsonFile(fileName)
 
+        self.tables = tables
+
         for tableName in tables:
             table = tables[tableName]
 
@@ -156,7 +381,7 @@ class Database:
             columns = get(table, 'columns')
             
             for column in columns:
-                string = f'{column} {columns[column]}'
+                string = f'{column} {self.getColumnType(table, column)}'
                 columnList.append(string)
 
             columnsString = ', '.join(columnList)
@@ -170,49 +395,493 @@ class Database:
             statement = f'create table if not exists {tableName} ( {columnsString}{primaryKeysString} )'
             self.execute(statement)
 
+            self.makeColumns(tableName, table)
+            self.makeIndexes(tableName, table)
+            self.makeSearchIndex(tableName, table)
+
+    # adds columns that were added to tables.json after the table was created
+    def makeColumns(self, tableName, table):
+        existing = []
+
+        if self.type == 'sqlite':
+            for row in self.execute(f'pragma table_info({tableName})', True):
+                existing.append(get(row, 'name'))
+        elif self.type == 'mysql':
+            # aliases because mysql 8 returns these names in upper case
+            rows = self.get('information_schema.columns', 'column_name as column_name', f'table_schema = database() and table_name = {self.placeholder}', parameters=[tableName])
+
+            for row in rows:
+                existing.append(get(row, 'column_name'))
+
+        columns = get(table, 'columns')
+
+        for column in columns:
+            if column in existing:
+                continue
+
+            logging.info(f'Adding column {column} to {tableName}')
+
+            self.execute(f'alter table {tableName} add column {column} {self.getColumnType(table, column)}')
+
+    # tables.json uses sqlite types
+    def getColumnType(self, table, column):
+        columnType = helpers.getNested(table, ['columns', column])
+        primaryKeys = get(table, 'primaryKeys')
+
+        if self.type != 'mysql':
+            return columnType
+
+        if columnType == 'integer':
+            # numbers new rows like an sqlite integer primary key does
+            if primaryKeys == [column]:
+                return 'bigint auto_increment'
+
+            # mysql's integer is only 32 bits
+            return 'bigint'
+        elif columnType == 'text':
+            # mysql can't use text columns as keys
+            if column in primaryKeys:
+                return self.stringKeyType
+
+            # mysql's text holds at most 64 KB. the json of a result can be more.
+            return 'longtext'
+
+        return columnType
+
+    # indexes look like "name": { "columns": [...], "unique": true, "where": "..." }. unique and where are optional.
+    def makeIndexes(self, tableName, table):
+        indexes = get(table, 'indexes')
+
+        if not indexes:
+            return
+
+        existing = self.getIndexes(tableName)
+
+        for indexName, index in indexes.items():
+            statement = self.getIndexStatement(tableName, table, indexName, index)
+
+            if not statement:
+                continue
+
+            if indexName in existing:
+                # same definition as last time
+                if existing[indexName] == self.getIndexDefinition(statement, index):
+                    continue
+
+                logging.info(f'Index {indexName} changed. Recreating it.')
+
+                if self.type == 'sqlite':
+                    self.execute(f'drop index {indexName}')
+                elif self.type == 'mysql':
+                    self.execute(f'drop index {indexName} on {tableName}')
+
+            logging.debug(f'Creating index {indexName}')
+            self.execute(statement)
+
+    # a full text index looks like "search": { "name": "...", "columns": [...], "weights": [...] }. weights are optional.
+    # it's a sqlite fts5 table that reads the text from the table itself. insert keeps it up to date.
+    def makeSearchIndex(self, tableName, table):
+        search = get(table, 'search')
+
+        if not search or self.type != 'sqlite':
+            return
+
+        name = get(search, 'name')
+
+        row = self.getFirst('sqlite_master', 'sql', f'type = {self.placeholder} and name = {self.placeholder}', parameters=['table', name])
+
+        if not self.useSearchIndexes:
+            # it would get out of date
+            if row:
+                logging.info(f'Deleting full text index {name}')
+                self.execute(f'drop table {name}')
+
+            return
+
+        self.searchIndexes[tableName] = search
+
+        columns = ', '.join(get(search, 'columns'))
+
+        statement = f"create virtual table {name} using fts5({columns}, content='{tableName}', content_rowid='rowid')"
+
+        # sqlite keeps the statement with its own capitalization
+        if helpers.squeezeWhitespace(get(row, 'sql')).lower() == helpers.squeezeWhitespace(statement).lower():
+            return
+
+        if row:
+            logging.info(f'Full text index {name} changed. Recreating it.')
+            self.execute(f'drop table {name}')
+
+        self.execute(statement)
+
+        weights = get(search, 'weights')
+
+        if weights:
+            weightsString = ', '.join([str(float(weight)) for weight in weights])
+
+            self.execute(f"insert into {name} ({name}, rank) values ('rank', 'bm25({weightsString})')")
+
+        self.rebuildSearchIndex(tableName)
+
+    def rebuildSearchIndex(self, tableName):
+        name = helpers.getNested(self.searchIndexes, [tableName, 'name'])
+
+        if not name:
+            logging.error(f'{tableName} has no full text index. Is searchIndex 1?')
+            return
+
+        logging.info(f'Building full text index {name}')
+
+        self.execute(f"insert into {name} ({name}) values ('rebuild')")
+
+    # the search index is external content, so it needs the old text to forget a row. this gives it the old or new text.
+    def updateSearchIndex(self, tableName, items, isDelete):
+        search = get(self.searchIndexes, tableName)
+
+        if not search:
+            return
+
+        name = get(search, 'name')
+        columns = ', '.join(get(search, 'columns'))
+
+        keyColumn = self.tables[tableName]['primaryKeys'][0]
+
+        keys = []
+
+        for item in items:
+            if item.get(keyColumn) != None:
+                keys.append(item.get(keyColumn))
+
+        if not keys:
+            return
+
+        placeholders = ', '.join([self.placeholder] * len(keys))
+
+        commandPart = ''
+        commandColumnPart = ''
+
+        if isDelete:
+            commandColumnPart = f'{name}, '
+            commandPart = "'delete', "
+
+        self.executeWithRetries(f'insert into {name} ({commandColumnPart}rowid, {columns}) select {commandPart}rowid, {columns} from {tableName} where {keyColumn} in ({placeholders})', keys)
+
+    # ranked by bm25 using the weights from tables.json. text is a few words. all of them must match.
+    def searchText(self, tableName, text, columns, limit=20):
+        import re
+
+        name = helpers.getNested(self.searchIndexes, [tableName, 'name'])
+
+        if not name:
+            logging.error(f'{tableName} has no full text index. Is searchIndex 1?')
+            return []
+
+        words = []
+
+        # quoted so punctuation isn't read as query syntax
+        for word in re.findall(r'\w+', text):
+            words.append(f'"{word}"')
+
+        if not words:
+            return []
+
+        columnsString = ', '.join([f'{tableName}.{column}' for column in columns])
+
+        query = f'select {columnsString} from {name} join {tableName} on {tableName}.rowid = {name}.rowid where {name} match {self.placeholder} order by {name}.rank limit {int(limit)}'
+
+        return self.execute(query, True, [' '.join(words)])
+
+    def getIndexStatement(self, tableName, table, indexName, index):
+        columns = []
+
+        for column in get(index, 'columns'):
+            # mysql can only index the start of a text column
+            if self.type == 'mysql' and helpers.getNested(table, ['columns', column]) == 'text':
+                column += '(100)'
+
+            columns.append(column)
+
+        uniquePart = ''
+        wherePart = ''
+
+        if get(index, 'unique'):
+            uniquePart = 'unique '
+
+        if get(index, 'where'):
+            if self.type == 'mysql':
+                logging.info(f'Mysql doesn\'t support partial indexes. Indexing all rows for {indexName}.')
+            else:
+                wherePart = f' where {get(index, "where")}'
+
+        return f'create {uniquePart}index {indexName} on {tableName} ({", ".join(columns)}){wherePart}'
+
+    # something to compare to what getIndexes returns
+    def getIndexDefinition(self, statement, index):
+        if self.type == 'sqlite':
+            return helpers.squeezeWhitespace(statement).lower()
+        elif self.type == 'mysql':
+            return (tuple(get(index, 'columns')), bool(get(index, 'unique')))
+
+    def getIndexes(self, tableName):
+        result = {}
+
+        if self.type == 'sqlite':
+            rows = self.get('sqlite_master', 'name, sql', f'type = {self.placeholder} and tbl_name = {self.placeholder}', parameters=['index', tableName])
+
+            for row in rows:
+                # automatic indexes for primary keys have no sql
+                if not get(row, 'sql'):
+                    continue
+
+                result[get(row, 'name')] = helpers.squeezeWhitespace(get(row, 'sql')).lower()
+        elif self.type == 'mysql':
+            # aliases because mysql 8 returns these names in upper case
+            rows = self.get('information_schema.statistics', 'index_name as index_name, column_name as column_name, non_unique as non_unique', f'table_schema = database() and table_name = {self.placeholder}', 'index_name, seq_in_index', 'asc', parameters=[tableName])
+
+            columns = {}
+            unique = {}
+
+            for row in rows:
+                name = get(row, 'index_name')
+
+                if name == 'PRIMARY':
+                    continue
+
+                columns[name] = columns.get(name, ()) + (get(row, 'column_name'),)
+                unique[name] = not get(row, 'non_unique')
+
+            for name in columns:
+                result[name] = (columns[name], unique[name])
+
+        return result
+
     def open(self, name):
         if not name:
             return
 
         try:
             if self.type == 'sqlite':
-                self.connection = sqlite3.connect(name)
+                # the crawl pipeline writes from its own thread. self.lock keeps access serialized.
+                # isolation_level None means transactions are started by executeWithRetries
+                self.connection = sqlite3.connect(name, timeout=self.busyTimeout / 1000, check_same_thread=False, isolation_level=None)
                 # to get column names
                 self.connection.row_factory = sqlite3.Row
                 self.cursor = self.connection.cursor()
+
+                self.tune()
             elif self.type == 'mysql':
-                import mysql.connector                
-                
-                self.connection = mysql.connector.connect(host=get(name, 'host'), user=get(name, 'user'), passwd=get(name, 'password'))
+                import mysql.connector
+                import mysql.connector.pooling
+
+                # the pool's connections need the database to exist
+                connection = mysql.connector.connect(host=get(name, 'host'), user=get(name, 'user'), passwd=get(name, 'password'))
+                cursor = connection.cursor()
+                cursor.execute(f'CREATE DATABASE IF NOT EXISTS {get(name, "database")} CHARACTER SET utf8 COLLATE utf8_general_ci;')
+                cursor.close()
+                connection.close()
+
+                self.pool = mysql.connector.pooling.MySQLConnectionPool(pool_size=self.mysqlPoolSize, host=get(name, 'host'), user=get(name, 'user'), passwd=get(name, 'password'), database=get(name, 'database'), autocommit=False)
+
+                self.connection = self.pool.get_connection()
                 # buffered part is because otherwise get "Unread result found" error when you connection.commit without cursor.fetchAll
                 self.cursor = self.connection.cursor(dictionary=True, buffered=True)
 
-                self.cursor.execute(f'CREATE DATABASE IF NOT EXISTS {get(name, "database")} CHARACTER SET utf8 COLLATE utf8_general_ci;')
-                self.cursor.execute(f'use {get(name, "database")};')
-
         except Exception as e:
             self.handleException(e)
 
+    # applies the sqlite pragmas from self.tuning
+    def tune(self):
+        if not self.tuning:
+            return
+
+        for name, value in self.tuning.items():
+            if value == '' or value == None:
+                continue
+
+            logging.debug(f'Setting {name} to {value}')
+
+            self.cursor.execute(f'pragma {name} = {value}')
+
+            # some pragmas like journal_mode return a row
+            self.cursor.fetchall()
+
     def handleException(self, e):
         helpers.handleException(e, 'Database error')
 
     def close(self):
         if self.connection:
-            self.connection.commit()
-            self.cursor.close()
-            self.connection.close()
+            with self.lock:
+                self.stopCommitTimer()
+                self.connection.commit()
+                self.cursor.close()
+                self.connection.close()
 
-    def __init__(self, tablesFile=None, name='user-data/database.sqlite', type='sqlite'):
+    def __init__(self, tablesFile=None, name='user-data/database.sqlite', type='sqlite', options=None):
         self.type = type
+        self.name = name
+        self.pool = None
         self.connection = None
         self.cursor = None
+        self.lock = threading.RLock()
+
+        # commit after this many inserted rows or this much time, whichever comes first
+        self.commitEveryRows = get(options, 'commitEveryRows') or 1
+        self.commitEveryMilliseconds = get(options, 'commitEveryMilliseconds') or 0
+        self.uncommittedRows = 0
+        self.lastCommit = time.monotonic()
+        self.transactionDepth = 0
+        self.commitTimer = None
+
+        # connections for iterate come from the pool. see mysqlPoolSize.
+        self.mysqlPoolSize = get(options, 'mysqlPoolSize') or 5
+        self.mysqlBatchSize = get(options, 'mysqlBatchSize') or 500
+        self.mysqlRetries = get(options, 'mysqlRetries') or 10
+
+        # how long to wait for other processes that are writing to the sqlite file
+        self.busyTimeout = get(options, 'sqliteBusyTimeout') or 30000
+        self.sqliteRetries = get(options, 'sqliteRetries') or 3
+
+        # statements since the last commit. mysql needs them again after a deadlock.
+        self.pendingStatements = []
+
+        # table name to its search definition in tables.json. see makeSearchIndex.
+        self.useSearchIndexes = get(options, 'searchIndex')
+        self.searchIndexes = {}
+        self.tables = {}
+
+        self.tuning = {}
+
+        # suits a crawler that writes all the time while exports read at the same time
+        if get(options, 'sqliteTuning'):
+            self.tuning = {
+                'journal_mode': get(options, 'sqliteJournalMode') or 'wal',
+                'synchronous': get(options, 'sqliteSynchronous') or 'normal',
+                'busy_timeout': self.busyTimeout,
+                'cache_size': get(options, 'sqliteCacheSize') or -64000,
+                'mmap_size': get(options, 'sqliteMmapSize') or 256 * 1000 * 1000,
+                'temp_store': get(options, 'sqliteTempStore') or 'memory'
+            }
 
         self.stringKeyType = 'text'
+        self.placeholder = '?'
 
         if self.type == 'mysql':
             self.stringKeyType = 'varchar(100)'
+            self.placeholder = '%s'
         
         self.open(name)
 
         if tablesFile:
-            self.makeTables(tablesFile)
\ No newline at end of file
+            self.makeTables(tablesFile)
+
+# runs database jobs on one thread so the threads that download never wait for the disk.
+# jobs that are waiting are run together in one transaction. submit blocks while the queue is full.
+class DatabaseWriter:
+    def submit(self, function, *arguments):
+        self.start()
+
+        self.queue.put((function, arguments))
+
+    def work(self):
+        retry = []
+
+        while True:
+            # jobs that couldn't get the lock go first
+            if retry:
+                jobs = retry
+                retry = []
+            else:
+                jobs = [self.queue.get()]
+
+            # whatever else is already waiting, up to the batch size
+            while len(jobs) < self.batchSize:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+
+            try:
+                with self.database.transaction():
+                    for job in jobs:
+                        if job is self.stop:
+                            stop = True
+                            continue
+
+                        function, arguments = job
+
+                        try:
+                            # a job that fails doesn't leave half its rows behind
+                            with self.database.transaction():
+                                function(*arguments)
+                        except Exception as e:
+                            if self.database.isBusy(e):
+                                self.log.warning('Database is busy. Will save this result again.')
+                                retry.append(job)
+                                continue
+
+                            helpers.handleException(e, 'Error in database writer', self.log.name)
+            except Exception as e:
+                if not self.database.isBusy(e):
+                    raise
+
+                # couldn't get the write lock, so nothing was written
+                self.log.warning('Database is busy. Will save these results again.')
+
+                retry = [job for job in jobs if not job is self.stop]
+                stop = len(retry) < len(jobs)
+
+            # while there's nothing to write, other processes shouldn't wait for the write lock
+            if self.queue.empty():
+                self.database.flush()
+
+            # finishes after the jobs that are left. it's marked done when it stops.
+            if retry and stop:
+                retry.append(self.stop)
+                stop = False
+
+            for job in jobs:
+                if not any(job is item for item in retry):
+                    self.queue.task_done()
+
+            if retry:
+                time.sleep(1)
+
+            if stop:
+                break
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+
+            self.thread = threading.Thread(target=self.work, name='database-writer', daemon=True)
+            self.thread.start()
+
+    # waits until every submitted job is done
+    def drain(self):
+        if self.thread:
+            self.queue.join()
+
+        self.database.flush()
+
+    def finish(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+
+        if thread:
+            self.queue.put(self.stop)
+            thread.join()
+
+        self.database.flush()
+
+    def __init__(self, database, options=None):
+        self.database = database
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.queue = queue.Queue(get(options, 'databaseWriterQueueSize') or 1000)
+        self.batchSize = get(options, 'databaseWriterBatchSize') or 100
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop = object()
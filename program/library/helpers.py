@@ -66,6 +66,32 @@ def getJsonFile(fileName):
     return result
 
 
+# files read by getJsonTemplate, stored pickled because unpickling is a cheaper copy than copy.deepcopy
+jsonTemplates = {}
+
+def getJsonTemplate(fileName):
+    import pickle
+
+    if not fileName in jsonTemplates:
+        jsonTemplates[fileName] = pickle.dumps(getJsonFile(fileName), pickle.HIGHEST_PROTOCOL)
+
+    # a new copy each time so callers can change it
+    return pickle.loads(jsonTemplates[fileName])
+
+
+compactJsonEncoder = None
+
+def toCompactJson(item):
+    global compactJsonEncoder
+
+    if not compactJsonEncoder:
+        import json
+
+        compactJsonEncoder = json.JSONEncoder(separators=(',', ':'))
+
+    return compactJsonEncoder.encode(item)
+
+
 def getLines(fileName):
     if not os.path.isfile(fileName):
         return []
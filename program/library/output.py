@@ -0,0 +1,92 @@
+import os
+import sys
+import csv
+import time
+import logging
+import threading
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from . import helpers
+
+    from .helpers import get
+
+# keeps a csv file open for appending. rows are flushed to disk after a number of rows or an amount of time.
+class CsvWriter:
+    def write(self, row):
+        with self.lock:
+            self.writer.writerow(row)
+
+            self.unflushedRows += 1
+
+            if self.unflushedRows >= self.flushEveryRows:
+                self.flush()
+            elif self.flushEveryMilliseconds and time.monotonic() - self.lastFlush >= self.flushEveryMilliseconds / 1000:
+                self.flush()
+            else:
+                self.startFlushTimer()
+
+    # so rows don't stay in memory while nothing else gets written, like during a captcha wait
+    def startFlushTimer(self):
+        if not self.flushEveryMilliseconds or self.flushTimer:
+            return
+
+        self.flushTimer = threading.Timer(self.flushEveryMilliseconds / 1000, self.onFlushTimer)
+        self.flushTimer.daemon = True
+        self.flushTimer.start()
+
+    def onFlushTimer(self):
+        with self.lock:
+            self.flushTimer = None
+
+            if self.unflushedRows:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.flushTimer:
+                self.flushTimer.cancel()
+                self.flushTimer = None
+
+            if self.file.closed:
+                return
+
+            self.file.flush()
+
+            self.unflushedRows = 0
+            self.lastFlush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+
+            self.flush()
+            self.file.close()
+
+    def open(self):
+        # only a new or empty file needs headers
+        needsHeaders = not os.path.exists(self.fileName) or os.path.getsize(self.fileName) == 0
+
+        self.file = open(self.fileName, 'a', encoding='utf-8', newline='\n', buffering=1024 * 1024)
+        self.writer = csv.writer(self.file, delimiter=',')
+
+        if needsHeaders and self.headers:
+            self.write(self.headers)
+
+    def __init__(self, fileName, headers=None, options=None):
+        self.fileName = fileName
+        self.headers = headers
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.lock = threading.RLock()
+
+        self.flushEveryRows = get(options, 'flushOutputEveryRows') or 1
+        self.flushEveryMilliseconds = get(options, 'flushOutputEveryMilliseconds') or 0
+        self.unflushedRows = 0
+        self.lastFlush = time.monotonic()
+        self.flushTimer = None
+
+        self.open()
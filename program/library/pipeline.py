@@ -0,0 +1,124 @@
+import sys
+import logging
+import queue
+import threading
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from . import helpers
+
+    from .helpers import get
+
+# a stage passes what its function returns to the next stage. returning None drops the item.
+class Stage:
+    def work(self):
+        while True:
+            item = self.queue.get()
+
+            if item is self.pipeline.stop:
+                break
+
+            try:
+                result = self.function(item)
+
+                if result != None and self.next:
+                    # blocks while the next stage is full. that's the backpressure.
+                    self.next.queue.put(result)
+            except Exception as e:
+                helpers.handleException(e, f'Error in {self.name} stage', self.pipeline.log.name)
+
+        with self.lock:
+            self.runningWorkers -= 1
+
+            lastWorker = self.runningWorkers == 0
+
+        # the next stage stops only once everything from this stage reached it
+        if lastWorker and self.next:
+            self.next.stop()
+
+    def start(self):
+        self.runningWorkers = self.workers
+
+        for i in range(0, self.workers):
+            thread = threading.Thread(target=self.work, name=f'{self.name}-{i + 1}', daemon=True)
+            thread.start()
+
+            self.threads.append(thread)
+
+    def stop(self):
+        for i in range(0, self.workers):
+            self.queue.put(self.pipeline.stop)
+
+    def __init__(self, pipeline, name, function, workers, queueSize):
+        self.pipeline = pipeline
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(queueSize)
+        self.next = None
+        self.threads = []
+        self.runningWorkers = 0
+        self.lock = threading.Lock()
+
+class Pipeline:
+    def addStage(self, name, function, workers=1, queueSize=100):
+        stage = Stage(self, name, function, max(workers, 1), queueSize)
+
+        if self.stages:
+            self.stages[-1].next = stage
+
+        self.stages.append(stage)
+
+    def start(self):
+        if self.started:
+            return
+
+        self.started = True
+
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item):
+        self.start()
+
+        self.stages[0].queue.put(item)
+
+    # waits until every item has gone through every stage
+    def finish(self):
+        if not self.started:
+            return
+
+        self.stages[0].stop()
+
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+
+            stage.threads = []
+
+        self.started = False
+
+    def getQueueDepths(self):
+        result = {}
+
+        for stage in self.stages:
+            result[stage.name] = stage.queue.qsize()
+
+        return result
+
+    def logQueueDepths(self):
+        depths = []
+
+        for name, depth in self.getQueueDepths().items():
+            depths.append(f'{name} {depth}')
+
+        self.log.info('Queue depths: ' + ', '.join(depths))
+
+    def __init__(self, options=None):
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.stages = []
+        self.started = False
+        self.stop = object()
@@ -0,0 +1,403 @@
+import os
+import re
+import sys
+import json
+import zlib
+import lzma
+import base64
+import logging
+import threading
+
+from datetime import datetime
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from . import helpers
+
+    from .helpers import get
+
+# encodes and decodes the json column. compressed values start with a prefix that says how to decode them,
+# so a database can have a mix of formats and old rows still work after jsonFormat changes.
+# with rawJsonRetention set to blob, the json is in the jsonBlob table instead and jsonVersion lists each result's versions.
+class JsonStorage:
+    def encode(self, item):
+        if self.format == 'pretty':
+            return json.dumps(item, indent=4)
+
+        text = helpers.toCompactJson(item)
+
+        if self.format == 'compact':
+            return text
+
+        data = text.encode('utf-8')
+
+        result = None
+
+        if self.format == 'lzma':
+            result = b'lzma:' + lzma.compress(data)
+        elif self.format == 'dictionary':
+            dictionaryId, dictionary = self.getCurrentDictionary()
+
+            if dictionary:
+                compressor = zlib.compressobj(self.level, zdict=dictionary)
+
+                result = f'dictionary:{dictionaryId}:'.encode('utf-8') + compressor.compress(data) + compressor.flush()
+
+        if result == None:
+            result = b'zlib:' + zlib.compress(data, self.level)
+
+        # mysql text columns can't hold binary data
+        if self.database.type == 'mysql':
+            result = 'base64:' + base64.b64encode(result).decode('ascii')
+
+        return result
+
+    def decode(self, value):
+        if not value:
+            return None
+
+        if isinstance(value, str):
+            if not value.startswith('base64:'):
+                return json.loads(value)
+
+            value = base64.b64decode(value[len('base64:'):])
+
+        value = bytes(value)
+
+        text = value
+
+        if value.startswith(b'zlib:'):
+            text = zlib.decompress(value[len('zlib:'):])
+        elif value.startswith(b'lzma:'):
+            text = lzma.decompress(value[len('lzma:'):])
+        elif value.startswith(b'dictionary:'):
+            prefix, dictionaryId, data = value.split(b':', 2)
+
+            decompressor = zlib.decompressobj(zdict=self.getDictionary(dictionaryId.decode('utf-8')))
+
+            text = decompressor.decompress(data) + decompressor.flush()
+
+        return json.loads(text)
+
+    def getCurrentDictionary(self):
+        with self.lock:
+            if self.currentDictionaryId == None:
+                row = self.database.getFirst('jsonDictionary', 'id', '', 'gmDate', 'desc')
+
+                self.currentDictionaryId = get(row, 'id')
+
+                if not self.currentDictionaryId:
+                    self.currentDictionaryId = self.trainDictionary()
+            elif not self.currentDictionaryId:
+                self.resultsWithoutDictionary += 1
+
+                # there might be enough results to learn from by now
+                if self.resultsWithoutDictionary >= self.trainAgainAfter:
+                    self.resultsWithoutDictionary = 0
+                    self.currentDictionaryId = self.trainDictionary()
+
+            if not self.currentDictionaryId:
+                return '', b''
+
+            return self.currentDictionaryId, self.getDictionary(self.currentDictionaryId)
+
+    def getDictionary(self, dictionaryId):
+        with self.lock:
+            if not dictionaryId in self.dictionaries:
+                row = self.database.getFirst('jsonDictionary', 'dictionary', f'id = {self.database.placeholder}', parameters=[dictionaryId])
+
+                if not row:
+                    raise Exception(f'There is no json dictionary with id {dictionaryId}')
+
+                self.dictionaries[dictionaryId] = get(row, 'dictionary').encode('utf-8')
+
+            return self.dictionaries[dictionaryId]
+
+    # zlib can start from a preset dictionary of up to 32 KB. it's made of the keys and values that most results have.
+    # the most common ones go at the end, where they're cheapest to refer to. returns the id or '' when there are no results yet.
+    def trainDictionary(self):
+        rows = []
+
+        if self.retention == 'blob':
+            rows = self.database.get('jsonBlob', 'json', '', None, None, self.options['jsonDictionarySamples'])
+
+        # also when moving inline json to blobs
+        if not rows:
+            rows = self.database.get('result', 'json', 'json is not null', 'gmDate', 'desc', self.options['jsonDictionarySamples'])
+
+        counts = {}
+        samples = 0
+
+        for row in rows:
+            try:
+                text = helpers.toCompactJson(self.decode(get(row, 'json')))
+            except Exception as e:
+                continue
+
+            samples += 1
+
+            for fragment in set(re.findall(r'[{\[,]?"[^"\\]{1,100}"[:,]?', text)):
+                counts[fragment] = counts.get(fragment, 0) + 1
+
+        if not samples:
+            self.log.info(f'No results to make a json dictionary from yet. Using zlib without a dictionary for the next {self.trainAgainAfter} results.')
+            return ''
+
+        minimumCount = max(2, samples // 10)
+
+        fragments = []
+
+        for fragment, count in counts.items():
+            if count >= minimumCount:
+                fragments.append(fragment)
+
+        fragments.sort(key=lambda fragment: counts[fragment] * len(fragment), reverse=True)
+
+        chosen = []
+        size = 0
+
+        for fragment in fragments:
+            length = len(fragment.encode('utf-8'))
+
+            if size + length > 32 * 1024:
+                continue
+
+            chosen.append(fragment)
+            size += length
+
+        chosen.sort(key=lambda fragment: counts[fragment])
+
+        dictionary = ''.join(chosen)
+
+        if not dictionary:
+            return ''
+
+        dictionaryId = helpers.hash(dictionary)[0:12]
+
+        self.database.insert('jsonDictionary', {
+            'id': dictionaryId,
+            'gmDate': str(datetime.utcnow()),
+            'dictionary': dictionary
+        })
+
+        # not flushed here. this can run in the middle of storing a result, and it gets committed with it.
+
+        self.log.info(f'Made json dictionary {dictionaryId} from {samples} results. Size: {size} bytes.')
+
+        return dictionaryId
+
+    # sets the json column of a result that's about to be stored. see rawJsonRetention.
+    def prepare(self, result):
+        item = get(result, 'json')
+
+        result['json'] = None
+
+        if not item or self.retention == 'none':
+            return
+
+        if self.retention == 'inline':
+            result['json'] = self.encode(item)
+        elif self.retention == 'blob':
+            result['jsonHash'] = self.storeBlob(get(result, 'id'), get(result, 'gmDate'), item)
+
+    # identical payloads are stored once
+    def storeBlob(self, resultId, gmDate, item):
+        placeholder = self.database.placeholder
+
+        blobHash = helpers.hash(helpers.toCompactJson(item))
+
+        if not self.database.getFirst('jsonBlob', 'hash', f'hash = {placeholder}', parameters=[blobHash]):
+            self.database.insert('jsonBlob', {
+                'hash': blobHash,
+                'json': self.encode(item)
+            })
+
+        self.database.insert('jsonVersion', {
+            'resultId': resultId,
+            'gmDate': gmDate,
+            'hash': blobHash
+        })
+
+        self.pruneVersions(resultId)
+
+        return blobHash
+
+    def getBlob(self, blobHash):
+        row = self.database.getFirst('jsonBlob', 'json', f'hash = {self.database.placeholder}', parameters=[blobHash])
+
+        return self.decode(get(row, 'json'))
+
+    # keeps the latest rawJsonVersions versions of a result and deletes blobs nothing uses anymore
+    def pruneVersions(self, resultId):
+        placeholder = self.database.placeholder
+
+        if not self.versions:
+            return
+
+        rows = self.database.get('jsonVersion', 'gmDate, hash', f'resultId = {placeholder}', 'gmDate', 'desc', parameters=[resultId])
+
+        old = rows[self.versions:]
+
+        if not old:
+            return
+
+        self.database.executeMany(f'delete from jsonVersion where resultId = {placeholder} and gmDate <= {placeholder}', [[resultId, get(old[0], 'gmDate')]])
+
+        self.deleteUnusedBlobs(set([get(row, 'hash') for row in old]))
+
+    def deleteUnusedBlobs(self, blobHashes):
+        placeholder = self.database.placeholder
+
+        toDelete = []
+
+        for blobHash in blobHashes:
+            toDelete.append([blobHash, blobHash])
+
+        self.database.executeMany(f'delete from jsonBlob where hash = {placeholder} and not exists (select 1 from jsonVersion where jsonVersion.hash = {placeholder})', toDelete)
+
+    # re-encodes every result in the current format and moves the json to where rawJsonRetention says
+    def migrate(self):
+        placeholder = self.database.placeholder
+
+        self.log.info(f'Converting the json of each result to {self.format}. Retention: {self.retention}.')
+
+        if self.format == 'dictionary':
+            with self.lock:
+                # a fresh dictionary fits the current data best
+                self.currentDictionaryId = self.trainDictionary()
+
+        sizeBefore = self.getDatabaseSize()
+
+        lastId = ''
+        count = 0
+
+        while True:
+            rows = self.database.get('result', 'id, gmDate, json, jsonHash', f'id > {placeholder}', 'id', 'asc', self.options['refreshPageSize'], [lastId])
+
+            if not rows:
+                break
+
+            toUpdate = []
+
+            for row in rows:
+                item = None
+
+                try:
+                    if get(row, 'json'):
+                        item = self.decode(get(row, 'json'))
+                    elif get(row, 'jsonHash') and self.retention == 'inline':
+                        item = self.getBlob(get(row, 'jsonHash'))
+                except Exception as e:
+                    helpers.handleException(e, f'Could not decode the json of {get(row, "id")}', self.log.name)
+                    continue
+
+                if item == None:
+                    continue
+
+                result = {
+                    'id': get(row, 'id'),
+                    'gmDate': get(row, 'gmDate'),
+                    'json': item,
+                    'jsonHash': get(row, 'jsonHash')
+                }
+
+                self.prepare(result)
+
+                # not get() because that turns None into ''
+                toUpdate.append([result['json'], result['jsonHash'], result['id']])
+
+            self.database.executeMany(f'update result set json = {placeholder}, jsonHash = {placeholder} where id = {placeholder}', toUpdate)
+
+            count += len(toUpdate)
+            lastId = get(rows[-1], 'id')
+
+            self.log.info(f'Converted {count} results')
+
+        if self.retention == 'blob':
+            self.migrateBlobs()
+        else:
+            self.log.info('Deleting stored versions')
+
+            self.database.execute('delete from jsonVersion')
+            self.database.execute('delete from jsonBlob')
+            self.database.execute('update result set jsonHash = null where jsonHash is not null')
+
+        self.database.flush()
+
+        if self.database.type == 'sqlite':
+            self.log.info('Reclaiming free space in the database file')
+
+            self.database.execute('vacuum')
+
+            self.log.info(f'Database size went from {sizeBefore} to {self.getDatabaseSize()} bytes')
+
+    def migrateBlobs(self):
+        placeholder = self.database.placeholder
+
+        # rawJsonVersions might be lower than before
+        if self.versions:
+            for row in self.database.execute(f'select resultId from jsonVersion group by resultId having count(*) > {placeholder}', True, [self.versions]):
+                self.pruneVersions(get(row, 'resultId'))
+
+        lastHash = ''
+        count = 0
+
+        while True:
+            rows = self.database.get('jsonBlob', 'hash, json', f'hash > {placeholder}', 'hash', 'asc', self.options['refreshPageSize'], [lastHash])
+
+            if not rows:
+                break
+
+            toUpdate = []
+
+            for row in rows:
+                try:
+                    toUpdate.append([self.encode(self.decode(get(row, 'json'))), get(row, 'hash')])
+                except Exception as e:
+                    helpers.handleException(e, f'Could not decode blob {get(row, "hash")}', self.log.name)
+
+            self.database.executeMany(f'update jsonBlob set json = {placeholder} where hash = {placeholder}', toUpdate)
+
+            count += len(toUpdate)
+            lastHash = get(rows[-1], 'hash')
+
+            self.log.info(f'Converted {count} stored versions')
+
+    def getDatabaseSize(self):
+        if self.database.type != 'sqlite' or not os.path.exists(self.database.name):
+            return 0
+
+        # otherwise recent changes, including the vacuum, are still in the wal file
+        self.database.flush()
+        self.database.execute('pragma wal_checkpoint(truncate)', True)
+
+        return os.path.getsize(self.database.name)
+
+    def __init__(self, options, database):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.database = database
+        self.lock = threading.RLock()
+
+        self.format = get(options, 'jsonFormat') or 'compact'
+        self.level = get(options, 'jsonCompressionLevel') or 6
+
+        if not self.format in ['pretty', 'compact', 'zlib', 'lzma', 'dictionary']:
+            self.log.error(f'Unknown jsonFormat {self.format}. Using compact.')
+            self.format = 'compact'
+
+        self.retention = get(options, 'rawJsonRetention') or 'inline'
+        self.versions = get(options, 'rawJsonVersions') or 0
+
+        if not self.retention in ['inline', 'blob', 'none']:
+            self.log.error(f'Unknown rawJsonRetention {self.retention}. Using inline.')
+            self.retention = 'inline'
+
+        self.currentDictionaryId = None
+        self.dictionaries = {}
+
+        self.resultsWithoutDictionary = 0
+        self.trainAgainAfter = 100
@@ -0,0 +1,162 @@
+import sys
+import time
+import logging
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from database import Database
+    from helpers import get
+else:
+    from ..library import helpers
+
+    from ..library.database import Database
+    from ..library.helpers import get
+
+# how many rows per second each database type can insert, update and look up, in the batches the crawler uses.
+# sqlite runs with and without sqliteTuning. lookups by other columns run with and without an index.
+class DatabaseBenchmark:
+    def run(self):
+        for tuning in [1, 0]:
+            self.runForType('sqlite', 'user-data/benchmark.sqlite', tuning)
+
+        if not self.options['mysqlUser']:
+            self.log.info('Skipping mysql. Set mysqlHost, mysqlUser, mysqlPassword and mysqlDatabase to include it.')
+            return
+
+        name = {
+            'host': self.options['mysqlHost'],
+            'user': self.options['mysqlUser'],
+            'password': self.options['mysqlPassword'],
+            'database': self.options['mysqlDatabase']
+        }
+
+        try:
+            import mysql.connector
+        except ImportError:
+            self.log.info('Skipping mysql. The mysql-connector-python package is not installed.')
+            return
+
+        try:
+            connection = mysql.connector.connect(host=get(name, 'host'), user=get(name, 'user'), passwd=get(name, 'password'))
+            connection.close()
+        except Exception as e:
+            self.log.info(f'Skipping mysql. Can\'t connect to {get(name, "host")}: {e}')
+            return
+
+        self.runForType('mysql', name)
+
+    def runForType(self, type, name, tuning=None):
+        options = dict(self.options)
+        description = type
+
+        if tuning != None:
+            options['sqliteTuning'] = tuning
+            description += ' with tuning' if tuning else ' without tuning'
+
+        # the journal mode stays with the file
+        self.removeFiles(type, name)
+
+        database = Database(None, name, type, options)
+
+        database.execute('drop table if exists benchmark')
+        database.execute(f'create table benchmark (id {database.stringKeyType}, permalink text, name text, value integer, gmDate text, primary key(id))')
+
+        rows = self.options['benchmarkRows']
+        batchSize = 100
+
+        for step in ['insert', 'update']:
+            start = time.time()
+
+            for i in range(0, rows, batchSize):
+                batch = []
+
+                for j in range(i, min(i + batchSize, rows)):
+                    batch.append({
+                        'id': f'id{j}',
+                        'permalink': f'permalink{j}',
+                        'name': f'{step} {j}',
+                        'value': j,
+                        'gmDate': str(time.time())
+                    })
+
+                database.insert('benchmark', batch)
+
+            database.flush()
+
+            self.logSpeed(description, step, rows, time.time() - start)
+
+        start = time.time()
+
+        self.lookUp(database, 'id', rows)
+
+        self.logSpeed(description, 'freshness lookup', rows, time.time() - start)
+
+        self.compareIndexes(database, description, rows)
+
+        database.execute('drop table benchmark')
+        database.close()
+
+        self.removeFiles(type, name)
+
+    # like permalink and gmDate in the result table. without an index each query reads the whole table, so fewer are timed.
+    def compareIndexes(self, database, description, rows):
+        table = {
+            'columns': {
+                'permalink': 'text',
+                'gmDate': 'text'
+            }
+        }
+
+        lookups = min(rows, 5000)
+        queries = 10
+
+        for indexed in [False, True]:
+            if indexed:
+                for column in ['permalink', 'gmDate']:
+                    database.execute(database.getIndexStatement('benchmark', table, f'benchmark{column}', {'columns': [column]}))
+
+            suffix = 'with index' if indexed else 'without index'
+
+            start = time.time()
+
+            self.lookUp(database, 'permalink', lookups)
+
+            self.logSpeed(description, f'lookup by permalink {suffix}', lookups, time.time() - start)
+
+            start = time.time()
+
+            # like the oldest results that refreshOnly picks
+            for i in range(queries):
+                database.get('benchmark', 'id', f'gmDate >= {database.placeholder}', 'gmDate', 'asc', 100, ['0'])
+
+            seconds = time.time() - start
+
+            self.log.info(f'{description} oldest 100 by gmDate {suffix}: {queries} queries in {round(seconds, 2)} seconds. {round(seconds / queries * 1000, 1)} ms per query.')
+
+    # like checkFreshness. many ids per query.
+    def lookUp(self, database, column, rows):
+        placeholder = database.placeholder
+
+        groupSize = 500
+
+        for i in range(0, rows, groupSize):
+            group = [f'{column}{j}' for j in range(i, min(i + groupSize, rows))]
+
+            placeholders = ', '.join([placeholder] * len(group))
+
+            database.get('benchmark', f'{column}, gmDate', f'{column} in ({placeholders}) and gmDate >= {placeholder}', parameters=group + ['0'])
+
+    def logSpeed(self, description, step, rows, seconds):
+        self.log.info(f'{description} {step}: {rows} rows in {round(seconds, 2)} seconds. {round(rows / max(seconds, 0.001))} rows per second.')
+
+    def removeFiles(self, type, name):
+        if type != 'sqlite':
+            return
+
+        for suffix in ['', '-wal', '-shm']:
+            helpers.removeFile(name + suffix)
+
+    def __init__(self, options):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
@@ -4,6 +4,7 @@ import logging
 import json
 import time
 import random
+import threading
 
 from datetime import datetime, timedelta
 
@@ -13,21 +14,37 @@ import lxml.html as lh
 if '--debug' in sys.argv:
     import helpers as helpers
 
-    from database import Database
-    from api import Api
+    from database import Database, DatabaseWriter
+    from api import Api, Throttle, Sessions
     from other import Internet
     from website import Website
     from google import Google
+    from pipeline import Pipeline
+    from output import CsvWriter
+    from storage import JsonStorage
+
+    from export import Export
+    from refresh import RefreshScheduler
+    from normalized import NormalizedTables
+    from history import ProfileHistory
 
     from helpers import get
 else:
     from ..library import helpers
 
-    from ..library.database import Database
-    from ..library.api import Api
+    from ..library.database import Database, DatabaseWriter
+    from ..library.api import Api, Throttle, Sessions
     from ..library.other import Internet
     from ..library.website import Website
     from ..library.google import Google
+    from ..library.pipeline import Pipeline
+    from ..library.output import CsvWriter
+    from ..library.storage import JsonStorage
+
+    from .export import Export
+    from .refresh import RefreshScheduler
+    from .normalized import NormalizedTables
+    from .history import ProfileHistory
 
     from ..library.helpers import get
 
@@ -63,103 +80,294 @@ class Crunchbase:
             except Exception as e:
                 helpers.handleException(e)
 
+        self.finishPipeline()
+
+        self.compactOutputFile()
+
+        self.outputWriter.flush()
+
         self.markDone()
 
     def output(self, inputRow, newResult):
         if not get(newResult, 'id'):
             return
 
-        id = get(newResult, 'id')
-
         self.log.debug('Writing to csv file')
 
-        outputFile = self.options['outputFile']
+        values = self.getOutputValues(newResult)
 
-        ignoreColumns = [
-            'permalink',
-            'id',
-            'json'
-        ]
+        # the id isn't one of the columns, so use the url
+        url = get(newResult, 'crunchbaseUrl')
 
-        fields = list(newResult.keys())
+        inFile = url in self.outputUrls
 
-        for ignoreColumn in ignoreColumns:
-            fields.remove(ignoreColumn)
+        if not inFile:
+            # this quotes fields that contain commas
+            self.outputWriter.write(values)
 
-        self.writeHeaders(fields, outputFile)
+            self.outputUrls.add(url)
+        elif not self.options['refreshOnly']:
+            self.log.debug(f'Not writing {get(newResult, "permalink")} to output file. Already in the output file.')
 
-        values = []
+        self.writeToDatabase(self.saveResult, inputRow, newResult, inFile and self.options['refreshOnly'])
 
-        otherValues = {}
+        if self.options['compactOutputEvery'] and len(self.refreshedUrls) >= self.options['compactOutputEvery']:
+            self.compactOutputFile()
 
-        for field in fields:
-            value = ''
+    def getOutputWriter(self):
+        printableFields = []
+        
+        for field in self.getOutputFields():
+            printableFields.append(self.getPrintableField(field))
 
-            if get(otherValues, field):
-                value = get(otherValues, field)
-            else:
-                value = get(newResult, field)
+        return CsvWriter(self.options['outputFile'], printableFields, self.options)
 
-            if not value:
-                value = helpers.getNested(newResult, ['json', field])
+    # for new rows and for the ones compactOutputFile rewrites from the database, so both look the same
+    def getOutputValues(self, result):
+        values = []
 
-            values.append(value)
+        for field in self.getOutputFields():
+            values.append(get(result, field))
+
+        return values
+
+    # the columns of the output file in order
+    def getOutputFields(self):
+        return [
+            'gmDate',
+            'name',
+            'description',
+            'industries',
+            'fundingTotal',
+            'currency',
+            'companyRank',
+            'organizationRank',
+            'investorRank',
+            'founded',
+            'founders',
+            'operatingStatus',
+            'fundingStatus',
+            'lastFundingType',
+            'numberOfEmployees',
+            'alsoKnownAs',
+            'legalName',
+            'hubTags',
+            'ipoStatus',
+            'companyType',
+            'website',
+            'facebook',
+            'linkedin',
+            'twitter',
+            'email',
+            'phone',
+            'longDescription',
+            'boardMembers',
+            'numberOfFundingRounds',
+            'fundingRounds',
+            'employees',
+            'numberOfInvestors',
+            'numberOfLeadInvestors',
+            'investors',
+            'newsAndActivity',
+            'investments',
+            'city',
+            'region',
+            'country',
+            'crunchbaseUrl',
+            'keyword'
+        ]
 
-        inFile = False
-        
-        if f',{id},' in helpers.getFile(self.options['outputFile']):
-            inFile = True
-        
-        # remove it so can update it
-        if inFile and self.options['refreshOnly']:
-            self.removeFromCsvFile(id, outputFile)
+    def export(self):
+        export = Export(self.options, self.database, self.jsonStorage, self.getOutputFields(), self.getPrintableField)
 
-        if not inFile or self.options['refreshOnly']:
-            # this quotes fields that contain commas
-            helpers.appendCsvFile(values, outputFile)
-        else:
-            self.log.debug(f'Not writing {get(newResult, "permalink")} to output file. Already in the output file.')
+        export.run(self.options['exportFile'], self.options['exportFormat'], self.options['exportColumns'], self.options['exportSince'], self.options['exportChangedSince'])
 
-        self.storeToDatabase(inputRow, newResult)
+    def migrateJson(self):
+        self.jsonStorage.migrate()
 
-    def writeHeaders(self, fields, outputFile):
-        if not os.path.exists(outputFile):
-            printableNames = {
-                'gmDate': 'date found',
-                'companyRank': 'CB Rank (Company)',
-                'organizationRank': 'CB Rank (Organization)',
-                'investorRank': 'CB Rank (Investor)'
+    def getDatabase(self):
+        if self.options['databaseType'] == 'mysql':
+            name = {
+                'host': self.options['mysqlHost'],
+                'user': self.options['mysqlUser'],
+                'password': self.options['mysqlPassword'],
+                'database': self.options['mysqlDatabase']
             }
 
-            printableFields = []
-            
-            for field in fields:
-                printableName = None
-                
-                if field in printableNames:
-                    printableName = get(printableNames, field)
-                else:
-                    printableName = helpers.getPrintableName(field)
-                
-                printableFields.append(printableName)
-            
-            helpers.toFile(','.join(printableFields) + '\n', outputFile)
+            return Database('program/resources/tables.json', name, 'mysql', self.options)
+
+        return Database('program/resources/tables.json', options=self.options)
+
+    def find(self, text):
+        start = time.time()
+
+        rows = self.database.searchText('result', text, ['name', 'crunchbaseUrl', 'industries', 'description'], self.options['findLimit'])
+
+        self.log.info(f'Found {len(rows)} results for {text} in {round((time.time() - start) * 1000)} ms')
+
+        for i, row in enumerate(rows):
+            self.log.info(f'{i + 1}. {get(row, "name")}: {get(row, "description")} {get(row, "industries")} {get(row, "crunchbaseUrl")}')
+
+    # how a result looked on a date according to resultHistory. company is a permalink or an id.
+    def showAsOf(self, company, date):
+        row = self.database.getFirst('result', 'id', f'permalink = {self.database.placeholder} or id = {self.database.placeholder}', parameters=[company, company])
+
+        if not row:
+            self.log.error(f'{company} is not in the database')
+            return
+
+        history = ProfileHistory(self.options, self.database, self.getHashedFields(), self.getComparableValue)
+
+        result = history.getAsOf(get(row, 'id'), date)
+
+        if not result:
+            self.log.info(f'There is no history for {company} on or before {date}')
+            return
+
+        self.log.info(json.dumps(result, indent=4))
+
+    def rebuildSearchIndex(self):
+        self.database.rebuildSearchIndex('result')
+
+    def getPrintableField(self, field):
+        printableNames = {
+            'gmDate': 'date found',
+            'companyRank': 'CB Rank (Company)',
+            'organizationRank': 'CB Rank (Organization)',
+            'investorRank': 'CB Rank (Investor)'
+        }
+
+        if field in printableNames:
+            return get(printableNames, field)
+
+        return helpers.getPrintableName(field)
+
+    # replaces the rows of refreshed results with their latest version from the database. rewrites the file once instead of once per result.
+    def compactOutputFile(self):
+        # the database writer adds to refreshedUrls
+        self.flushDatabase()
+
+        if not self.refreshedUrls:
+            return
+
+        outputFile = self.options['outputFile']
+        temporaryFile = outputFile + '.tmp'
+
+        self.log.info(f'Updating {len(self.refreshedUrls)} refreshed results in {outputFile}')
+
+        # so it has everything written so far
+        self.outputWriter.close()
+
+        import csv
+
+        with open(outputFile, encoding='utf-8', newline='') as inputFile, open(temporaryFile, 'w', encoding='utf-8', newline='') as file:
+            reader = csv.reader(inputFile)
+            writer = csv.writer(file, delimiter=',')
+
+            headers = next(reader, [])
+            writer.writerow(headers)
+
+            urlIndex = headers.index(self.getPrintableField('crunchbaseUrl'))
+
+            for row in reader:
+                if urlIndex < len(row) and row[urlIndex] in self.refreshedUrls:
+                    continue
+
+                writer.writerow(row)
+
+            for row in self.getRowsForUrls(list(self.refreshedUrls)):
+                valuesByHeader = {}
+
+                for field, value in zip(self.getOutputFields(), self.getOutputValues(row)):
+                    valuesByHeader[self.getPrintableField(field)] = value
+
+                values = []
+
+                for header in headers:
+                    values.append(get(valuesByHeader, header))
 
-    def getProfile(self, url):
+                writer.writerow(values)
+
+        os.replace(temporaryFile, outputFile)
+
+        self.outputWriter = self.getOutputWriter()
+
+        self.refreshedUrls = set()
+
+    def getRowsForUrls(self, urls):
+        placeholder = self.database.placeholder
+
+        groupSize = 500
+
+        for start in range(0, len(urls), groupSize):
+            group = urls[start:start + groupSize]
+
+            placeholders = ', '.join([placeholder] * len(group))
+
+            # all columns except the large json one
+            rows = self.database.get('result', self.getColumns('result', ['json']), f'crunchbaseUrl in ({placeholders})', parameters=group)
+
+            for row in rows:
+                yield row
+
+    # output and the database writer need this for every result
+    def getColumns(self, tableName, exclude=[]):
+        key = (tableName, tuple(exclude))
+
+        if not key in self.columns:
+            result = []
+
+            tables = helpers.getJsonFile('program/resources/tables.json')
+
+            for column in helpers.getNested(tables, [tableName, 'columns']):
+                if not column in exclude:
+                    result.append(column)
+
+            self.columns[key] = ', '.join(result)
+
+        return self.columns[key]
+
+    def getProfile(self, url, keyword=''):
+        job = {
+            'url': url,
+            'keyword': keyword
+        }
+
+        for function in [self.downloadProfile, self.parseProfile, self.addNewsAndActivity]:
+            job = function(job)
+
+            if not job:
+                return {}
+
+        return job['profile']
+
+    # the functions below are the stages of the pipeline. each one takes a job and returns it or None to drop it.
+    def downloadProfile(self, job):
         self.api.proxies = self.internet.getRandomProxy()
 
+        # news and activity might be downloaded on another thread. it should use the same proxy.
+        job['proxies'] = self.api.proxies
+
         self.checkProxy()
         
         self.api.setHeadersFromHarFile('program/resources/headers.json', '')
 
+        self.log.info(f'Getting profile for {self.getProfileId(job["url"])}')
+        
+        job['page'] = self.getPage(job['url'])
+
+        if not job['page']:
+            return None
+
+        return job
+
+    def parseProfile(self, job):
         result = {}
 
-        self.log.info(f'Getting profile for {self.getProfileId(url)}')
-        
-        document = self.getDocument(url)
+        document = lh.fromstring(job['page'])
 
-        if document == None:
-            return result
+        # no longer needed and it's large
+        del job['page']
         
         jsonElements = self.website.getXpath('', "//script[@type = 'application/ld+json' or @type = 'application/json']", False, None, document)
 
@@ -176,11 +384,58 @@ class Crunchbase:
             dictionary = json.loads(text)
 
             if isMain:
-                result = self.getMainInformation(dictionary)
+                result = self.getMainInformation(dictionary, get(job, 'keyword'))
+
+        if not result:
+            return None
+
+        job['profile'] = result
         
-        return result
+        return job
+
+    def addNewsAndActivity(self, job):
+        profile = job['profile']
+
+        self.api.proxies = job.get('proxies')
+
+        # the profile download already waited for its turn. this is part of the same profile.
+        self.api.throttle = None
+
+        profile['json']['newsAndActivity'] = self.getNewsAndActivity(get(profile, 'id'))
+        profile['newsAndActivity'] = self.getStringFromArray(profile['json'], ['newsAndActivity'], 'newsAndActivity')
+
+        return job
+
+    def writeProfile(self, job):
+        self.output(get(job, 'inputRow'), job['profile'])
+
+    def getPipeline(self):
+        if not self.pipeline:
+            workers = self.options['profileWorkers']
+            queueSize = self.options['pipelineQueueSize']
+
+            self.pipeline = Pipeline(self.options)
+
+            self.pipeline.addStage('fetch', self.downloadProfile, workers, queueSize)
+            self.pipeline.addStage('parse', self.parseProfile, self.options['parserWorkers'], queueSize)
+            self.pipeline.addStage('activities', self.addNewsAndActivity, workers, queueSize)
+            # only one thread writes to the output file and database
+            self.pipeline.addStage('write', self.writeProfile, 1, queueSize)
+
+        return self.pipeline
+
+    def finishPipeline(self):
+        if not self.pipeline:
+            return
+
+        self.log.info('Waiting for profiles that are still in progress')
+
+        self.pipeline.logQueueDepths()
+        self.pipeline.finish()
+
+        self.flushDatabase()
 
-    def getMainInformation(self, dictionary):
+    def getMainInformation(self, dictionary, keyword=''):
         dictionary = get(dictionary, 'HttpState')
 
         found = False
@@ -244,8 +499,6 @@ class Crunchbase:
         fundingRounds = '\n'.join(fundingRoundsStrings)
 
         companyId = helpers.getNested(dictionary, ['properties', 'identifier', 'uuid'])
-        
-        dictionary['newsAndActivity'] = self.getNewsAndActivity(companyId)
 
         result = {
             'id': companyId,
@@ -283,13 +536,14 @@ class Crunchbase:
             'numberOfInvestors': helpers.getNested(dictionary, ['cards', 'investors_headline', 'num_investors']),
             'numberOfLeadInvestors': helpers.getNested(dictionary, ['cards', 'investors_headline', 'num_lead_investors']),
             'investors': self.getInvestorsString(dictionary),
-            'newsAndActivity': self.getStringFromArray(dictionary, ['newsAndActivity'], 'newsAndActivity'),
+            # filled in by addNewsAndActivity
+            'newsAndActivity': '',
             'investments': self.getStringFromArray(dictionary, ['cards', 'investments_list'], 'investment'),
             'city': self.findByValue(locations, 'location_type', 'city', 'value'),
             'region': self.findByValue(locations, 'location_type', 'region', 'value'),
             'country': self.findByValue(locations, 'location_type', 'country', 'value'),
             'crunchbaseUrl': 'https://www.crunchbase.com/organization/' + helpers.getNested(dictionary, ['properties', 'identifier', 'permalink']),
-            'keyword': get(self.inputRow, 'keyword'),
+            'keyword': keyword,
             'permalink': helpers.getNested(dictionary, ['properties', 'identifier', 'permalink']),
             'json': dictionary
         }
@@ -303,11 +557,11 @@ class Crunchbase:
 
         self.api.setHeadersFromHarFile('program/resources/headers-search.json', '')
         
-        toSend = helpers.getJsonFile('program/resources/body-activities.json')
+        toSend = helpers.getJsonTemplate('program/resources/body-activities.json')
         
         toSend['query'][0]['values'][0] = companyId
 
-        toSend = json.dumps(toSend)
+        toSend = helpers.toCompactJson(toSend)
         
         response = self.api.post(f'/v4/data/searches/activities', data=toSend, responseIsJson=False, returnResponseObject=True)
 
@@ -525,19 +779,18 @@ class Crunchbase:
         elif searchSite == 'crunchbase.com':
             # use crunchbase search as a backup
             if os.path.exists('user-data/credentials/www.crunchbase.com.har'):
-                self.api.options['randomizeUserAgent'] = 0
-                self.api.setHeadersFromHarFile('user-data/credentials/www.crunchbase.com.har', '/v4/data/searches/organizations?source=slug')
-                self.api.options['randomizeUserAgent'] = 1
+                # the profile workers share the options, so don't change them
+                self.api.setHeadersFromHarFile('user-data/credentials/www.crunchbase.com.har', '/v4/data/searches/organizations?source=slug', randomizeUserAgent=False)
             else:
                 self.api.setHeadersFromHarFile('program/resources/headers-search.json', '')
 
             if get(inputRow, 'search type') == 'location':
                 self.api.proxies = None        
 
-                toSend = helpers.getJsonFile('program/resources/body-search.json')
+                toSend = helpers.getJsonTemplate('program/resources/body-search.json')
                 
                 if self.options['refreshOnly']:
-                    datePredicate = helpers.getJsonFile('program/resources/recently-founded.json')
+                    datePredicate = helpers.getJsonTemplate('program/resources/recently-founded.json')
                     toSend['query'][1] = datePredicate
                     toSend['query'][1]['values'][0] = self.options['dateForNewCompaniesSearch']
 
@@ -566,7 +819,7 @@ class Crunchbase:
                 if self.afterId:
                     toSend["after_id"] = self.afterId
 
-                toSend = json.dumps(toSend)
+                toSend = helpers.toCompactJson(toSend)
 
                 response = self.api.post(f'/v4/data/searches/organizations?source=slug', data=toSend, responseIsJson=False, returnResponseObject=True)
             else:
@@ -602,6 +855,8 @@ class Crunchbase:
                     self.afterId = ''
                     result = 'should stop'
 
+        self.checkFreshness(inputRow, searchResults, searchSite)
+
         for searchResult in searchResults:
             try:
                 if get(inputRow, 'search type') == 'location':
@@ -636,6 +891,9 @@ class Crunchbase:
             except Exception as e:
                 helpers.handleException(e)
 
+        if self.pipeline:
+            self.pipeline.logQueueDepths()
+
         if get(inputRow, 'search type') == 'location' and self.searchResultsCount == self.totalSearchResults:
             self.log.info('Reached end of search results')
             self.afterId = ''
@@ -653,12 +911,26 @@ class Crunchbase:
         if not self.passesFilters(searchResult, url, searchSite):
             return result
 
-        profile = self.getProfile(url)
-
-        self.output(inputRow, profile)
+        self.getOrQueueProfile(inputRow, url, get(self.inputRow, 'keyword'))
 
         return 'success'
 
+    def getOrQueueProfile(self, inputRow, url, keyword):
+        if self.options['profileWorkers'] > 1:
+            job = {
+                'url': url,
+                'keyword': keyword,
+                'inputRow': inputRow
+            }
+
+            # waits if the pipeline is full
+            self.getPipeline().put(job)
+            return
+
+        profile = self.getProfile(url, keyword)
+
+        self.output(inputRow, profile)
+
     def reachedSearchLimit(self):
         result = False
         
@@ -668,22 +940,18 @@ class Crunchbase:
         return result
 
     def refreshOnly(self):
-        # find rows not update in a long time
-        minimumDate = helpers.getDateStringSecondsAgo(self.options['hoursBetweenRuns'] * 3600, True)
+        scheduler = RefreshScheduler(self.options, self.database)
 
-        printableDate = helpers.findBetween(minimumDate, '', '.')
+        # find rows that are due, most urgent first
+        total = scheduler.makeQueue()
         
-        self.log.info(f'Refreshing all results not checked since {printableDate}')
-
-        rows = self.database.get('result', '*', f"gmDate < '{minimumDate}'")
-
-        random.shuffle(rows)
+        self.log.info(f'Refreshing {total} results that are due')
 
-        for i, row in enumerate(rows):
+        for i, row in enumerate(scheduler.getRows()):
             try:
-                self.log.info(f'Refreshing result {i + 1} of {len(rows)}: {get(row, "permalink")}')
+                self.log.info(f'Refreshing result {i + 1} of {total}: {get(row, "permalink")}')
                 
-                self.setLogPrefix(None, f'Refreshing {i + 1} of {len(rows)}: {get(row, "permalink")}')
+                self.setLogPrefix(None, f'Refreshing {i + 1} of {total}: {get(row, "permalink")}')
 
                 url = '/organization/' + get(row, 'permalink')
 
@@ -691,12 +959,14 @@ class Crunchbase:
                     'keyword': get(row, 'keyword')
                 }
 
-                profile = self.getProfile(url)
-
-                self.output(None, profile)
+                self.getOrQueueProfile(None, url, get(row, 'keyword'))
             except Exception as e:
                 helpers.handleException(e)
 
+        self.finishPipeline()
+
+        self.compactOutputFile()
+
         self.log.info(f'Done refreshing')
 
     def setLogPrefix(self, inputRow, line=''):
@@ -720,6 +990,16 @@ class Crunchbase:
     def passesFilters(self, searchResult, url, searchSite):
         result = True
 
+        key, id = self.getDatabaseKey(searchResult, searchSite)
+
+        name = self.getProfileId(url)
+
+        if self.inDatabaseAndNewEnough(key, id, name):
+            result = False
+
+        return result
+
+    def getDatabaseKey(self, searchResult, searchSite):
         key = 'id'
         id = ''
 
@@ -729,36 +1009,186 @@ class Crunchbase:
         elif searchSite == 'crunchbase.com':
             id = helpers.getNested(searchResult, ['identifier', 'uuid'])
 
-        name = self.getProfileId(url)
+        return key, id
 
-        if self.inDatabaseAndNewEnough(key, id, name):
-            result = False
+    # looks up a whole page of search results at once before any profiles are fetched
+    def checkFreshness(self, inputRow, searchResults, searchSite):
+        self.freshResults = {}
+
+        keys = {}
+
+        for searchResult in searchResults:
+            if get(inputRow, 'search type') == 'location':
+                searchResult = get(searchResult, 'properties')
+
+            key, id = self.getDatabaseKey(searchResult, searchSite)
+
+            if not key in keys:
+                keys[key] = []
+
+            keys[key].append(id)
+
+        for key, values in keys.items():
+            self.freshResults.update(self.getFreshResults(key, values))
+
+    # returns (key, value) -> gmDate. empty gmDate means it's missing or too old.
+    def getFreshResults(self, key, values):
+        result = {}
+
+        # is it too old?
+        minimumDate = helpers.getDateStringSecondsAgo(self.options['hoursBetweenRuns'] * 3600, True)
+
+        values = list(set(values))
+
+        for value in values:
+            result[(key, value)] = ''
+
+        placeholder = self.database.placeholder
+
+        # stay under the database's limit on the number of parameters
+        groupSize = 500
+
+        for start in range(0, len(values), groupSize):
+            group = values[start:start + groupSize]
+
+            placeholders = ', '.join([placeholder] * len(group))
+
+            rows = self.database.get('result', f'{key}, gmDate', f'{key} in ({placeholders}) and gmDate >= {placeholder}', parameters=group + [minimumDate])
+
+            for row in rows:
+                result[(key, get(row, key))] = get(row, 'gmDate')
 
         return result
 
     def inDatabaseAndNewEnough(self, key, value, name):
         result = False
 
-        # is it too old?
-        minimumDate = helpers.getDateStringSecondsAgo(self.options['hoursBetweenRuns'] * 3600, True)
+        # wasn't part of the page that was checked
+        if not (key, value) in self.freshResults:
+            self.freshResults.update(self.getFreshResults(key, [value]))
 
-        row = self.database.getFirst('result', '*', f"{key} = '{value}' and gmDate >= '{minimumDate}'")
+        date = self.freshResults[(key, value)]
 
-        if row:
-            date = helpers.findBetween(get(row, 'gmDate'), '', '.')
+        if date:
+            date = helpers.findBetween(date, '', '.')
             self.log.info(f'Skipping {name}. Already in the database and was updated less than {self.options["hoursBetweenRuns"]} hours ago. Updated: {date}.')
             result = True
         
         return result
 
-    def storeToDatabase(self, inputRow, newResult):
-        if get(newResult, 'json'):
-            if inputRow:
-                newResult['json']['inputRow'] = inputRow
-            
-            newResult['json'] = json.dumps(newResult['json'], indent=4)
+    # on the database writer thread if there is one
+    def writeToDatabase(self, function, *arguments):
+        if self.databaseWriter:
+            self.databaseWriter.submit(function, *arguments)
+        else:
+            function(*arguments)
+
+    # waits for the database writer and commits
+    def flushDatabase(self):
+        if self.databaseWriter:
+            self.databaseWriter.drain()
+        else:
+            self.database.flush()
+
+    # compares with the stored version on the database writer, so it sees writes that are still waiting to be committed.
+    # isRefresh means the result is already in the output file.
+    def saveResult(self, inputRow, newResult, isRefresh):
+        oldResult = self.database.getFirst('result', self.getColumns('result', ['json']), f'id = {self.database.placeholder}', parameters=[get(newResult, 'id')])
+
+        if not self.addChangeTracking(newResult, oldResult):
+            if isRefresh:
+                self.log.debug(f'Not updating {get(newResult, "permalink")} in the output file. It didn\'t change.')
+
+            self.touchResult(newResult)
+            return
+
+        if isRefresh:
+            # the new version gets written by compactOutputFile
+            self.log.debug(f'Will update {get(newResult, "permalink")} in the output file later')
+
+            self.refreshedUrls.add(get(newResult, 'crunchbaseUrl'))
+
+        self.storeToDatabase(inputRow, newResult, oldResult)
+
+    def storeToDatabase(self, inputRow, newResult, oldResult=None):
+        # prepare replaces the json with its encoded form. the database writer might need to store the original again.
+        newResult = dict(newResult)
+
+        if get(newResult, 'json') and inputRow:
+            newResult['json'] = dict(newResult['json'])
+            newResult['json']['inputRow'] = inputRow
+
+        # so the result and its rows in other tables are never out of sync
+        with self.database.transaction():
+            if self.normalizedTables:
+                self.normalizedTables.store(newResult)
+
+            if self.profileHistory:
+                self.profileHistory.store(newResult, oldResult)
+
+            self.jsonStorage.prepare(newResult)
+
+            self.database.insert('result', newResult)
+
+    # for results that didn't change. only the date and the counts need to be written.
+    def touchResult(self, newResult):
+        placeholder = self.database.placeholder
+
+        # part of the group commit instead of committing each update
+        self.database.executeMany(f'update result set gmDate = {placeholder}, refreshCount = {placeholder}, contentHash = {placeholder} where id = {placeholder}', [[get(newResult, 'gmDate'), get(newResult, 'refreshCount'), get(newResult, 'contentHash'), get(newResult, 'id')]])
+
+    # counts refreshes and how many of them changed something. the refresh scheduler uses this.
+    # returns whether the result is new or changed.
+    def addChangeTracking(self, newResult, oldResult):
+        newResult['contentHash'] = self.getContentHash(newResult)
+
+        if not oldResult:
+            newResult['refreshCount'] = 0
+            newResult['changeCount'] = 0
+            newResult['gmDateChanged'] = get(newResult, 'gmDate')
+            return True
+
+        # results stored before there was a hash
+        oldHash = get(oldResult, 'contentHash') or self.getContentHash(oldResult)
+
+        changed = oldHash != get(newResult, 'contentHash')
+
+        newResult['refreshCount'] = (get(oldResult, 'refreshCount') or 0) + 1
+        newResult['changeCount'] = get(oldResult, 'changeCount') or 0
+        newResult['gmDateChanged'] = get(oldResult, 'gmDateChanged') or None
 
-        self.database.insert('result', newResult)
+        if changed:
+            newResult['changeCount'] += 1
+            newResult['gmDateChanged'] = get(newResult, 'gmDate')
+
+        return changed
+
+    # of the extracted fields. the raw json isn't used because it has things like request ids that change every time.
+    def getContentHash(self, result):
+        values = []
+
+        for field in self.getHashedFields():
+            values.append(self.getComparableValue(get(result, field)))
+
+        return helpers.hash(json.dumps(values, ensure_ascii=False))
+
+    def getHashedFields(self):
+        if not self.hashedFields:
+            exclude = ['gmDate', 'keyword', 'json', 'jsonHash', 'refreshCount', 'changeCount', 'gmDateChanged', 'contentHash']
+
+            self.hashedFields = self.getColumns('result', exclude).split(', ')
+
+        return self.hashedFields
+
+    # the database can turn numbers into text and back
+    def getComparableValue(self, value):
+        if value == None:
+            value = ''
+
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+
+        return str(value)
 
     def getReady(self):
         helpers.makeDirectory(os.path.dirname(self.options['outputFile']))
@@ -771,6 +1201,42 @@ class Crunchbase:
                 helpers.removeFile(rotatedFileName)
                 os.rename(self.options['outputFile'], rotatedFileName)
 
+        self.outputUrls = self.getOutputUrls(self.options['outputFile'])
+
+        if self.outputWriter:
+            self.outputWriter.close()
+
+        self.outputWriter = self.getOutputWriter()
+
+    # reads the output file once. output() keeps the set up to date after that.
+    def getOutputUrls(self, outputFile):
+        result = set()
+
+        if not os.path.exists(outputFile):
+            return result
+
+        import csv
+
+        with open(outputFile, encoding='utf-8', newline='') as file:
+            reader = csv.reader(file)
+
+            headers = next(reader, [])
+
+            column = helpers.getPrintableName('crunchbaseUrl')
+
+            if not column in headers:
+                return result
+
+            index = headers.index(column)
+
+            for row in reader:
+                if index < len(row):
+                    result.add(row[index])
+
+        self.log.debug(f'Found {len(result)} results in {outputFile}')
+
+        return result
+
     def waitBetweenRequests(self, type=None):
         if type == 'profile':
             if get(self.options, 'secondsBetweenProfiles'):
@@ -779,20 +1245,21 @@ class Crunchbase:
             if get(self.options, 'secondsBetweenSearches'):
                 time.sleep(self.options['secondsBetweenSearches'])
 
-    def getDocument(self, url):
+    def getPage(self, url):
         response = self.api.get(url, None, False, True)
-        self.waitBetweenRequests('profile')
+
+        # workers are spaced out by the api's throttle instead
+        if not self.api.throttle:
+            self.waitBetweenRequests('profile')
 
         if response and 'verify you are a human' in response.text:
             self.log.error('There is a captcha')
-            return None
+            return ''
 
         if response == '' or not response or not response.content:
-            return None
-        
-        document = lh.fromstring(response.text)
+            return ''
         
-        return document
+        return response.text
 
     def isDone(self):
         result = False
@@ -813,19 +1280,6 @@ class Crunchbase:
 
         return result
 
-    def removeFromCsvFile(self, id, outputFile):
-        lines = helpers.getFile(outputFile).splitlines()
-        
-        newFile = ''
-
-        for line in lines:
-            if f',{id},' in line:
-                continue
-
-            newFile += line + '\n'
-
-        helpers.toFile(newFile, outputFile)
-
     def handleCaptcha(self, response):
         if response == '' or response == None:
             return
@@ -839,8 +1293,44 @@ class Crunchbase:
 
         if hasCaptcha:
             self.log.error('There is a captcha')
+
+            # so other processes can write while this one waits
+            self.database.flush()
+
+            if self.outputWriter:
+                self.outputWriter.flush()
+
             helpers.wait(random.randrange(60 * 60, 120 * 60))
 
+    @property
+    def api(self):
+        if not hasattr(self.threadData, 'api'):
+            api = Api('https://www.crunchbase.com', self.options)
+            api.timeout = 15
+            api.cachePostRequests = True
+            api.sessions = self.sessions
+
+            if threading.current_thread() != threading.main_thread():
+                api.throttle = self.throttle
+
+            self.threadData.api = api
+
+        return self.threadData.api
+
+    def close(self):
+        if self.pipeline:
+            self.pipeline.finish()
+
+        if self.databaseWriter:
+            self.databaseWriter.finish()
+
+        self.sessions.close()
+
+        if self.outputWriter:
+            self.outputWriter.close()
+
+        self.database.close()
+
     def checkProxy(self):
         if random.randrange(0, 100) == 0:
             original = self.api.urlPrefix
@@ -862,6 +1352,9 @@ class Crunchbase:
 
         self.database.insert('history', history)
 
+        # might wait a long time until the next run
+        self.flushDatabase()
+
     def waitForNextRun(self):
         self.log.info('Done this run')
 
@@ -872,6 +1365,9 @@ class Crunchbase:
         # added a few seconds for a margin of error
         nextDay = self.gmDateStarted + timedelta(hours=self.options['hoursBetweenRuns'], seconds=10)
 
+        self.flushDatabase()
+        self.outputWriter.flush()
+
         helpers.waitUntil(nextDay)
 
         return True
@@ -880,12 +1376,38 @@ class Crunchbase:
         self.options = options
         self.log = logging.getLogger(get(self.options, 'loggerName'))
 
-        self.database = Database('program/resources/tables.json')
+        self.database = self.getDatabase()
+        self.columns = {}
+        self.hashedFields = []
+        self.databaseWriter = None
+
+        if self.options['databaseWriter']:
+            self.databaseWriter = DatabaseWriter(self.database, self.options)
+
+        self.jsonStorage = JsonStorage(self.options, self.database)
+        self.normalizedTables = None
+
+        if self.options['normalizedTables']:
+            self.normalizedTables = NormalizedTables(self.options, self.database)
+
+        self.profileHistory = None
+
+        if self.options['profileHistory']:
+            self.profileHistory = ProfileHistory(self.options, self.database, self.getHashedFields(), self.getComparableValue)
+
+        # each worker thread gets its own api because headers and proxies change per request
+        self.threadData = threading.local()
+        self.pipeline = None
+        self.throttle = None
+        self.sessions = Sessions(self.options)
+
+        # request bodies are read once here and copied for each request
+        for fileName in ['body-search.json', 'body-activities.json', 'recently-founded.json']:
+            helpers.getJsonTemplate('program/resources/' + fileName)
+
+        if self.options['profileWorkers'] > 1:
+            self.throttle = Throttle(self.options['secondsBetweenProfiles'])
 
-        self.api = Api('https://www.crunchbase.com', self.options)
-        self.api.timeout = 15
-        self.api.cachePostRequests = True
-        
         self.internet = Internet(self.options)
         self.website = Website(self.options)
         self.google = Google(self.options)
@@ -896,4 +1418,8 @@ class Crunchbase:
         self.maximumRank = 0
         self.pageIndex = 0
         self.afterId = ''
-        self.totalSearchResults = 0
\ No newline at end of file
+        self.totalSearchResults = 0
+        self.freshResults = {}
+        self.outputUrls = set()
+        self.refreshedUrls = set()
+        self.outputWriter = None
\ No newline at end of file
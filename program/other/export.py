@@ -0,0 +1,189 @@
+import os
+import sys
+import csv
+import json
+import logging
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from ..library import helpers
+
+    from ..library.helpers import get
+
+# writes the result table to a file without loading it into memory
+class Export:
+    def run(self, fileName, format='csv', columns='', since='', changedSince=''):
+        if not format in ['csv', 'jsonl']:
+            self.log.error(f'Unknown format {format}. Use csv or jsonl.')
+            return
+
+        fields = self.getFields(columns)
+
+        if not fields:
+            return
+
+        changedAfter = ''
+
+        if changedSince:
+            changedAfter = self.getRunBoundary(changedSince)
+
+            if changedAfter == None:
+                return
+
+        if not fileName:
+            fileName = f'user-data/output/export.{format}'
+
+        helpers.makeDirectory(os.path.dirname(fileName))
+
+        self.log.info(f'Exporting to {fileName}')
+
+        rows = self.getRows(fields, since, changedAfter)
+
+        count = 0
+
+        if format == 'jsonl':
+            count = self.writeJsonLines(rows, fileName)
+        elif format == 'csv':
+            count = self.writeCsv(rows, fields, fileName)
+
+        self.log.info(f'Exported {count} results')
+
+    # columns is a comma-separated list of field names. empty means the same columns as the output file.
+    def getFields(self, columns):
+        result = []
+
+        if not columns:
+            return self.fields
+
+        for column in columns.split(','):
+            column = column.strip()
+
+            if not column in self.columns:
+                self.log.error(f'There is no column called {column}')
+                return []
+
+            result.append(column)
+
+        return result
+
+    def getRows(self, fields, since, changedAfter=''):
+        placeholder = self.database.placeholder
+
+        conditions = []
+        parameters = []
+
+        if since:
+            conditions.append(f'result.gmDate >= {placeholder}')
+            parameters.append(since)
+
+        # new results also get a gmDateChanged
+        if changedAfter:
+            conditions.append(f'result.gmDateChanged > {placeholder}')
+            parameters.append(changedAfter)
+
+        wherePart = ''
+
+        if conditions:
+            wherePart = ' where ' + ' and '.join(conditions)
+
+        columns = []
+        joinPart = ''
+
+        for field in fields:
+            if field == 'json':
+                # with rawJsonRetention set to blob, the json is in another table
+                columns.append('coalesce(result.json, jsonBlob.json) as json')
+                joinPart = ' left join jsonBlob on jsonBlob.hash = result.jsonHash'
+            else:
+                columns.append(f'result.{field}')
+
+        query = f'select {", ".join(columns)} from result{joinPart}{wherePart}'
+
+        return self.database.iterate(query, parameters)
+
+    # run is an id from the history table or "last" for the changes made by the latest run.
+    # returns when that run finished. empty means every result counts as changed.
+    def getRunBoundary(self, run):
+        placeholder = self.database.placeholder
+
+        where = 'gmDateCompleted is not null'
+
+        if run == 'last':
+            # the run before the latest one
+            rows = self.database.get('history', 'id, gmDateCompleted', where, 'gmDateCompleted', 'desc', 2)
+
+            if len(rows) < 2:
+                self.log.info('There is no earlier run. Exporting all results.')
+                return ''
+
+            row = rows[1]
+        else:
+            row = self.database.getFirst('history', 'id, gmDateCompleted', f'{where} and id = {placeholder}', parameters=[run])
+
+            if not row:
+                self.log.error(f'There is no finished run with id {run}')
+                return None
+
+        self.log.info(f'Exporting results that changed after run {get(row, "id")} finished at {get(row, "gmDateCompleted")}')
+
+        return get(row, 'gmDateCompleted')
+
+    def writeCsv(self, rows, fields, fileName):
+        count = 0
+
+        with open(fileName, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter=',')
+
+            headers = []
+
+            for field in fields:
+                headers.append(self.getPrintableField(field))
+
+            writer.writerow(headers)
+
+            for row in rows:
+                values = []
+
+                for field in fields:
+                    value = get(row, field)
+
+                    # might be compressed
+                    if field == 'json' and value:
+                        value = helpers.toCompactJson(self.jsonStorage.decode(value))
+
+                    values.append(value)
+
+                writer.writerow(values)
+
+                count += 1
+
+        return count
+
+    def writeJsonLines(self, rows, fileName):
+        count = 0
+
+        with open(fileName, 'w', encoding='utf-8') as file:
+            for row in rows:
+                if 'json' in row:
+                    row['json'] = self.jsonStorage.decode(row['json'])
+
+                file.write(json.dumps(row) + '\n')
+
+                count += 1
+
+        return count
+
+    def __init__(self, options, database, jsonStorage, fields, getPrintableField):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.database = database
+        self.jsonStorage = jsonStorage
+        self.fields = fields
+        self.getPrintableField = getPrintableField
+
+        tables = helpers.getJsonFile('program/resources/tables.json')
+
+        self.columns = list(helpers.getNested(tables, ['result', 'columns']))
@@ -0,0 +1,80 @@
+import sys
+import json
+import logging
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from ..library import helpers
+
+    from ..library.helpers import get
+
+# keeps each version of a result as the fields that changed since the version before it.
+# the first version of a result has all its fields. nothing is stored when a refresh changes nothing.
+class ProfileHistory:
+    def store(self, newResult, oldResult):
+        placeholder = self.database.placeholder
+
+        resultId = get(newResult, 'id')
+
+        if not resultId:
+            return
+
+        if oldResult and not self.database.getFirst('resultHistory', 'gmDate', f'resultId = {placeholder}', parameters=[resultId]):
+            # stored before there was history. it's the starting point.
+            self.database.insert('resultHistory', {
+                'resultId': resultId,
+                'gmDate': get(oldResult, 'gmDate'),
+                'changes': helpers.toCompactJson(self.getChanges({}, oldResult))
+            })
+
+        changes = self.getChanges(oldResult, newResult)
+
+        if not changes:
+            return
+
+        self.database.insert('resultHistory', {
+            'resultId': resultId,
+            'gmDate': get(newResult, 'gmDate'),
+            'changes': helpers.toCompactJson(changes)
+        })
+
+    def getChanges(self, oldResult, newResult):
+        result = {}
+
+        for field in self.fields:
+            newValue = newResult.get(field)
+
+            if oldResult and self.getComparableValue(oldResult.get(field)) == self.getComparableValue(newValue):
+                continue
+
+            result[field] = newValue
+
+        return result
+
+    # returns the fields of the latest version found on or before date. empty if there was none yet.
+    def getAsOf(self, resultId, date):
+        placeholder = self.database.placeholder
+
+        result = {}
+
+        rows = self.database.get('resultHistory', 'gmDate, changes', f'resultId = {placeholder} and gmDate <= {placeholder}', 'gmDate', 'asc', parameters=[resultId, date])
+
+        for row in rows:
+            result.update(json.loads(get(row, 'changes')))
+
+            result['gmDate'] = get(row, 'gmDate')
+
+        if result:
+            result['id'] = resultId
+
+        return result
+
+    def __init__(self, options, database, fields, getComparableValue):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.database = database
+        self.fields = fields
+        self.getComparableValue = getComparableValue
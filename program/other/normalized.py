@@ -0,0 +1,142 @@
+import sys
+import logging
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from ..library import helpers
+
+    from ..library.helpers import get
+
+# one row per funding round, investment, investor, employee and news item of a result, so they can be queried
+# without reading the json. a result's rows are replaced each time it's stored.
+class NormalizedTables:
+    def store(self, result):
+        resultId = get(result, 'id')
+        dictionary = get(result, 'json')
+
+        if not resultId or not dictionary:
+            return
+
+        placeholder = self.database.placeholder
+
+        rowsByTable = {
+            'fundingRound': self.getFundingRounds(resultId, dictionary),
+            'investment': self.getInvestments(resultId, dictionary),
+            'investorLink': self.getInvestorLinks(resultId, dictionary),
+            'employee': self.getEmployees(resultId, dictionary),
+            'activity': self.getActivities(resultId, dictionary)
+        }
+
+        for table, rows in rowsByTable.items():
+            self.database.executeMany(f'delete from {table} where resultId = {placeholder}', [[resultId]])
+
+            self.database.insert(table, rows)
+
+    def getFundingRounds(self, resultId, dictionary):
+        results = []
+
+        for i, item in enumerate(helpers.getNested(dictionary, ['cards', 'funding_rounds_list'])):
+            results.append({
+                'resultId': resultId,
+                'id': helpers.getNested(item, ['identifier', 'uuid']) or str(i),
+                'name': helpers.getNested(item, ['identifier', 'value']),
+                'date': get(item, 'announced_on'),
+                'moneyRaised': self.getNumber(helpers.getNested(item, ['money_raised', 'value'])),
+                'currency': helpers.getNested(item, ['money_raised', 'currency']),
+                'moneyRaisedUsd': self.getNumber(helpers.getNested(item, ['money_raised', 'value_usd'])),
+                'numberOfInvestors': self.getNumber(get(item, 'num_investors')),
+                'leadInvestors': self.joinByValue(get(item, 'lead_investor_identifiers'))
+            })
+
+        return results
+
+    def getInvestments(self, resultId, dictionary):
+        results = []
+
+        for i, item in enumerate(helpers.getNested(dictionary, ['cards', 'investments_list'])):
+            results.append({
+                'resultId': resultId,
+                'fundingRoundId': helpers.getNested(item, ['funding_round_identifier', 'uuid']) or str(i),
+                'fundingRoundName': helpers.getNested(item, ['funding_round_identifier', 'value']),
+                'organizationId': helpers.getNested(item, ['organization_identifier', 'uuid']),
+                'organizationName': helpers.getNested(item, ['organization_identifier', 'value']),
+                'date': get(item, 'announced_on'),
+                'moneyRaised': self.getNumber(helpers.getNested(item, ['funding_round_money_raised', 'value'])),
+                'currency': helpers.getNested(item, ['funding_round_money_raised', 'currency']),
+                'moneyRaisedUsd': self.getNumber(helpers.getNested(item, ['funding_round_money_raised', 'value_usd']))
+            })
+
+        return results
+
+    def getInvestorLinks(self, resultId, dictionary):
+        results = []
+
+        for i, item in enumerate(helpers.getNested(dictionary, ['cards', 'investors_list'])):
+            investorId = helpers.getNested(item, ['investor_identifier', 'uuid']) or str(i)
+
+            results.append({
+                'resultId': resultId,
+                'investorId': investorId,
+                'investorName': helpers.getNested(item, ['investor_identifier', 'value']),
+                'fundingRoundId': helpers.getNested(item, ['funding_round_identifier', 'uuid']) or str(i),
+                'fundingRoundName': helpers.getNested(item, ['funding_round_identifier', 'value']),
+                'isLead': 1 if get(item, 'is_lead_investor') else 0
+            })
+
+        return results
+
+    def getEmployees(self, resultId, dictionary):
+        results = []
+
+        for i, item in enumerate(helpers.getNested(dictionary, ['cards', 'current_employees_featured_order_field'])):
+            results.append({
+                'resultId': resultId,
+                'personId': helpers.getNested(item, ['person_identifier', 'uuid']) or str(i),
+                'name': helpers.getNested(item, ['person_identifier', 'value']),
+                'title': get(item, 'title')
+            })
+
+        return results
+
+    def getActivities(self, resultId, dictionary):
+        results = []
+
+        for i, item in enumerate(get(dictionary, 'newsAndActivity')):
+            results.append({
+                'resultId': resultId,
+                'id': helpers.getNested(item, ['properties', 'identifier', 'uuid']) or get(item, 'uuid') or str(i),
+                'date': helpers.getNested(item, ['properties', 'activity_date']),
+                'publisher': helpers.getNested(item, ['properties', 'activity_properties', 'publisher']),
+                'title': helpers.getNested(item, ['properties', 'identifier', 'value']),
+                'url': helpers.getNested(item, ['properties', 'activity_properties', 'url', 'value'])
+            })
+
+        return results
+
+    def getNumber(self, value):
+        if value == '' or value == None:
+            return None
+
+        try:
+            return int(value)
+        except Exception as e:
+            return None
+
+    def joinByValue(self, array):
+        strings = []
+
+        for item in array:
+            value = get(item, 'value')
+
+            if value:
+                strings.append(value)
+
+        return ' | '.join(strings)
+
+    def __init__(self, options, database):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.database = database
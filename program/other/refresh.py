@@ -0,0 +1,99 @@
+import sys
+import logging
+
+from datetime import datetime
+
+if '--debug' in sys.argv:
+    import helpers as helpers
+
+    from helpers import get
+else:
+    from ..library import helpers
+
+    from ..library.helpers import get
+
+# decides which results to refresh and in what order.
+# a result is due once its age times its weight reaches hoursBetweenRuns. the weight is higher for results that often
+# changed on past refreshes, have a good rank or have raised money, so they are refreshed more often.
+class RefreshScheduler:
+    # returns how many results are due
+    def makeQueue(self):
+        placeholder = self.database.placeholder
+
+        now = str(datetime.utcnow())
+
+        priority = self.getPriorityExpression(placeholder)
+
+        limitPart = ''
+
+        if self.options['refreshBudget']:
+            limitPart = f' limit {self.options["refreshBudget"]}'
+
+        self.dropQueue()
+
+        # one pass over the result table. the queue is read in pages after that. it only has the id to stay small.
+        self.database.execute(f'create temporary table refreshQueue as select id, priority from (select id, {priority} as priority from result) as scored where priority >= 1 order by priority desc, id desc{limitPart}', parameters=[now, self.options['hoursBetweenRuns']])
+        # temporary, so it doesn't lock the database for other processes
+        if self.database.type == 'sqlite':
+            self.database.execute('create index temp.refreshQueuePriority on refreshQueue (priority, id)')
+        else:
+            self.database.execute('create index refreshQueuePriority on refreshQueue (priority, id)')
+
+        return get(self.database.getFirst('refreshQueue', 'count(*) as count', ''), 'count')
+
+    # most urgent first, a page at a time
+    def getRows(self):
+        placeholder = self.database.placeholder
+
+        lastPriority = None
+        lastId = None
+
+        while True:
+            where = ''
+            parameters = []
+
+            if lastId != None:
+                where = f'(refreshQueue.priority, refreshQueue.id) < ({placeholder}, {placeholder})'
+                parameters = [lastPriority, lastId]
+
+            rows = self.database.get('refreshQueue join result on result.id = refreshQueue.id', 'result.id, permalink, keyword, gmDate, priority', where, 'priority desc, refreshQueue.id', 'desc', self.options['refreshPageSize'], parameters)
+
+            if not rows:
+                break
+
+            for row in rows:
+                yield row
+
+            lastPriority = get(rows[-1], 'priority')
+            lastId = get(rows[-1], 'id')
+
+        self.dropQueue()
+
+    def dropQueue(self):
+        if self.database.type == 'sqlite':
+            self.database.execute('drop table if exists temp.refreshQueue')
+        else:
+            self.database.execute('drop temporary table if exists refreshQueue')
+
+    # takes now and hoursBetweenRuns as parameters
+    def getPriorityExpression(self, placeholder):
+        ageInHours = f'((julianday({placeholder}) - julianday(gmDate)) * 24)'
+
+        if self.database.type == 'mysql':
+            ageInHours = f'(timestampdiff(second, gmDate, {placeholder}) / 3600)'
+
+        # from 0.5 for results that never change to 2 for ones that change on every refresh
+        volatility = '(0.5 + 1.5 * (coalesce(changeCount, 0) + 1.0) / (coalesce(refreshCount, 0) + 2.0))'
+
+        rank = '(companyRank + 0)'
+
+        rankWeight = f'(case when {rank} > 0 and {rank} <= 1000 then 2 when {rank} > 0 and {rank} <= 10000 then 1.5 when {rank} > 0 and {rank} <= 100000 then 1 when {rank} > 0 then 0.5 else 0.75 end)'
+
+        fundingWeight = '(case when fundingTotal > 0 then 1.25 else 1 end)'
+
+        return f'({ageInHours} * {volatility} * {rankWeight} * {fundingWeight} / {placeholder})'
+
+    def __init__(self, options, database):
+        self.options = options
+        self.log = logging.getLogger(get(options, 'loggerName'))
+        self.database = database